@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""bulk_export.py -- throughput and resume check of the /admin/export handler
+
+Stores --sessions sessions, then exports them through main.app in
+slices of at most --slice rows, following X-Export-Cursor into a local
+file the way an analytics client would, and checks that every session
+came out exactly once.
+
+    python benchmarks/bulk_export.py --sessions 100000 --format csv
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import stubs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sessions', type=int, default=20000)
+    parser.add_argument('--slice', type=int, default=5000,
+        help='EXPORT_MAX_ROWS used for the run')
+    parser.add_argument('--format', default='jsonl', choices=['jsonl', 'csv'])
+    args = parser.parse_args()
+
+    stubs.setUp()
+    import webapp2
+    from google.appengine.ext import ndb
+    import main as handlers
+    from models import Conference, Session
+
+    conf = Conference(name='Export', organizerUserId='organizer@example.com')
+    conf.put()
+    for i in range(0, args.sessions, 500):
+        ndb.put_multi([Session(parent=conf.key, name='Session %d' % j,
+            speaker='Speaker %d' % (j % 50), duration=60)
+            for j in range(i, min(i + 500, args.sessions))])
+
+    handlers.EXPORT_MAX_ROWS = args.slice
+    fd, path = tempfile.mkstemp(suffix='.' + args.format)
+    slices, cursor = 0, ''
+    start = time.time()
+    with os.fdopen(fd, 'w') as out:
+        while True:
+            response = webapp2.Request.blank('/admin/export/Session?' +
+                'format=%s&cursor=%s' % (args.format, cursor)).get_response(
+                handlers.app)
+            assert response.status_int == 200, response.status
+            out.write(response.body)
+            slices += 1
+            cursor = response.headers.get('X-Export-Cursor')
+            if not cursor:
+                break
+    elapsed = time.time() - start
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    if args.format == 'jsonl':
+        keys = [json.loads(line)['websafeKey'] for line in lines]
+    else:
+        keys = [line.split(',', 1)[0] for line in lines[1:]]
+    assert len(keys) == len(set(keys)) == args.sessions, (
+        '%d rows, %d distinct' % (len(keys), len(set(keys))))
+    print('%d sessions in %d slices, %.1fs (%.0f rows/s), %s' % (len(keys),
+        slices, elapsed, len(keys) / elapsed, path))
+
+
+if __name__ == '__main__':
+    main()
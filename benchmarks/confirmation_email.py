@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+"""confirmation_email.py -- confirmation email throughput, push vs pull
+
+Creates --conferences conferences spread over --organizers organisers,
+then delivers their confirmations twice against the local mail stub:
+once as the old push tasks (one handler request and one send_mail per
+conference) and once through the pull queue worker (leased batches,
+one send_mail per recipient). Reports tasks drained per second on one
+instance and mails sent.
+
+    python benchmarks/confirmation_email.py --conferences 2000 --organizers 20
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import stubs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--conferences', type=int, default=1000)
+    parser.add_argument('--organizers', type=int, default=20)
+    args = parser.parse_args()
+
+    tb = stubs.setUp()
+    import webapp2
+    import main as handlers
+    from conference import ConferenceApi, CONFIRMATION_QUEUE
+    from models import Conference, ConferenceForm
+
+    api = ConferenceApi()
+    for i in range(args.conferences):
+        stubs.login('organizer%d@example.com' % (i % args.organizers))
+        api._createConferenceObject(ConferenceForm(name='Conference %d' % i))
+    created = Conference.query().count()
+    assert created == args.conferences, '%d conferences created' % created
+    taskqueue = tb.get_stub('taskqueue')
+    mail = tb.get_stub('mail')
+    queued = len(taskqueue.GetTasks(CONFIRMATION_QUEUE))
+
+    # the old path: one push task request per conference
+    start = time.time()
+    for i in range(queued):
+        webapp2.Request.blank('/tasks/send_confirmation_email',
+            POST={'email': 'organizer%d@example.com' % (i % args.organizers),
+                'conferenceInfo': 'Conference %d' % i}).get_response(handlers.app)
+    push = time.time() - start
+    pushMails = len(mail.get_sent_messages())
+
+    start = time.time()
+    sent = ConferenceApi._sendConfirmationEmails()
+    pull = time.time() - start
+    left = len(taskqueue.GetTasks(CONFIRMATION_QUEUE))
+    assert left == 0, '%d confirmations left in the queue' % left
+
+    print('%-6s %10s %10s %12s' % ('path', 'tasks', 'mails', 'tasks/sec'))
+    print('%-6s %10d %10d %12.1f' % ('push', queued, pushMails, queued / push))
+    print('%-6s %10d %10d %12.1f' % ('pull', queued, sent, queued / pull))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""copiers.py -- reflective vs precompiled entity-to-message copiers
+
+Times the all_fields()/hasattr loops the API used to run per row against
+the copiers conference.py now builds at import time, on in-memory
+entities (no datastore calls), and checks both produce the same forms.
+
+    python benchmarks/copiers.py --rows 2000
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import stubs
+
+
+def reflectiveSession(session, SessionForm, SessionType):
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            if field.name == "dateTime":
+                s_date = getattr(session, field.name)
+                if s_date:
+                    setattr(sf, 'dateTime', s_date.strftime('%y-%m-%d'))
+                    setattr(sf, 'startTime', s_date.strftime('%H:%M'))
+            elif field.name == "typeOfSession":
+                currentType = getattr(session, field.name)
+                if currentType:
+                    setattr(sf, field.name, getattr(SessionType, str(currentType)))
+                else:
+                    setattr(sf, field.name, getattr(SessionType, 'NOT_SPECIFIED'))
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+        if field.name == "websafeSessionKey":
+            setattr(sf, field.name, session.key.urlsafe())
+    sf.check_initialized()
+    return sf
+
+
+def reflectiveConference(conf, ConferenceForm):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def timed(copy, rows):
+    start = time.time()
+    forms = [copy(row) for row in rows]
+    return time.time() - start, forms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    stubs.setUp()
+    import conference
+    from google.appengine.ext import ndb
+    from models import Conference, ConferenceForm, Session, SessionForm, SessionType
+
+    c_key = ndb.Key(Conference, 1)
+    start = datetime(2016, 5, 1, 9, 0)
+    sessions = [Session(key=ndb.Key(Session, i + 1, parent=c_key),
+        name='Session %d' % i, speaker='Speaker %d' % (i % 50), duration=60,
+        typeOfSession=('Workshop', 'Lecture', None)[i % 3],
+        dateTime=start + timedelta(minutes=30 * i),
+        startTime=(start + timedelta(minutes=30 * i)).strftime('%H:%M'))
+        for i in range(args.rows)]
+    confs = [Conference(key=ndb.Key(Conference, i + 1), name='Conf %d' % i,
+        city='City', topics=['Python'], startDate=start.date(), month=5,
+        maxAttendees=100, seatsAvailable=10, organizerUserId='me')
+        for i in range(args.rows)]
+
+    cases = [
+        ('session', sessions,
+            lambda s: reflectiveSession(s, SessionForm, SessionType),
+            conference.copySessionToForm),
+        ('conference', confs,
+            lambda c: reflectiveConference(c, ConferenceForm),
+            conference.copyConferenceToForm),
+    ]
+    print('%-12s %12s %12s %8s' % ('copier', 'old ms', 'new ms', 'speedup'))
+    for name, rows, old, new in cases:
+        oldTime = newTime = 0
+        for _ in range(args.repeat):
+            t, oldForms = timed(old, rows)
+            oldTime += t
+            t, newForms = timed(new, rows)
+            newTime += t
+        assert oldForms == newForms, '%s copiers disagree' % name
+        print('%-12s %12.1f %12.1f %7.1fx' % (name,
+            1000 * oldTime / args.repeat, 1000 * newTime / args.repeat,
+            oldTime / newTime))
+
+
+if __name__ == '__main__':
+    main()
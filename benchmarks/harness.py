@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+"""harness.py -- in-process load test of ConferenceApi endpoints
+
+Seeds the local datastore stub with profiles, conferences, sessions and
+registrations, then calls each endpoint --iterations times and reports
+latency percentiles, datastore RPCs per call and the memcache hit ratio.
+--concurrency N additionally runs registerForConference from N threads
+at once to exercise the transactional registration path.
+
+    python benchmarks/harness.py --conferences 200 --sessions 50
+    python benchmarks/harness.py --concurrency 20 --shards 10
+
+Keep the printed table from a known good build and compare before
+deploying; the numbers are only comparable on the same machine.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import itertools
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import stubs
+
+
+class RpcCounter(object):
+    """Count API calls per thread through an apiproxy pre-call hook."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def hook(self, service, call, request, response):
+        counts = getattr(self._local, 'counts', None)
+        if counts is not None:
+            counts[(service, call)] += 1
+
+    def start(self):
+        self._local.counts = defaultdict(int)
+
+    def stop(self):
+        counts, self._local.counts = self._local.counts, None
+        return counts
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def seed(args):
+    """Store the benchmark data set directly, bypassing the API."""
+    from google.appengine.ext import ndb
+    from models import Conference, Profile, Session
+
+    rnd = random.Random(args.seed)
+    cities = ['City %d' % i for i in range(20)]
+    types = ['Workshop', 'Lecture', 'Keynote', 'Motivational']
+    start = datetime(2016, 1, 1, 9, 0)
+
+    profiles = [Profile(id='user%d@example.com' % i,
+        displayName='User %d' % i, mainEmail='user%d@example.com' % i)
+        for i in range(args.profiles)]
+    confs = []
+    for i in range(args.conferences):
+        organizer = rnd.choice(profiles)
+        day = start + timedelta(days=rnd.randrange(365))
+        confs.append(Conference(parent=organizer.key, name='Conference %d' % i,
+            description='Benchmark conference %d' % i,
+            organizerUserId=organizer.key.id(),
+            organizerDisplayName=organizer.displayName,
+            topics=rnd.sample(['Python', 'Cloud', 'Web', 'Data'], 2),
+            city=rnd.choice(cities), startDate=day.date(), month=day.month,
+            endDate=(day + timedelta(days=2)).date(),
+            maxAttendees=args.profiles * 2, seatsAvailable=args.profiles * 2))
+    ndb.put_multi(confs)
+
+    sessions = []
+    for conf in confs:
+        for j in range(args.sessions):
+            when = datetime.combine(conf.startDate, start.time()) + timedelta(minutes=30 * j)
+            sessions.append(Session(parent=conf.key, name='Session %d' % j,
+                speaker='Speaker %d' % rnd.randrange(args.speakers),
+                duration=rnd.choice([30, 60, 90]), typeOfSession=rnd.choice(types),
+                dateTime=when, startTime=when.strftime('%H:%M')))
+    ndb.put_multi(sessions)
+
+    for prof in profiles:
+        for conf in rnd.sample(confs, min(args.registrations, len(confs))):
+            prof.addConference(conf.key)
+            conf.seatsAvailable -= 1
+        for sess in rnd.sample(sessions, min(args.wishlist, len(sessions))):
+            prof.addToWishlist(sess.key)
+    ndb.put_multi(profiles + confs)
+    return profiles, confs, sessions
+
+
+def scenarios(api, profiles, confs, sessions, rnd):
+    """Return (name, function) pairs; each function makes one call."""
+    from conference import CONF_GET_REQUEST, CONF_LIST_REQUEST, SESSION_GET_REQUEST
+    from conference import CONF_ETAG_REQUEST
+    from conference import SESSION_SPEAKER_POST_REQUEST, WISHLIST_REQUEST
+    from models import ConferenceQueryForm, ConferenceQueryForms
+    from protorpc import message_types
+
+    void = message_types.VoidMessage()
+    full = stubs.request(CONF_LIST_REQUEST)
+    summary = stubs.request(CONF_LIST_REQUEST, view='summary')
+    conf = lambda: rnd.choice(confs).key.urlsafe()
+    user = lambda: stubs.login(rnd.choice(profiles).key.id())
+    newUsers = ('bench%d@example.com' % i for i in itertools.count())
+
+    def register():
+        stubs.login(next(newUsers))
+        api.registerForConference(stubs.request(CONF_GET_REQUEST,
+            websafeConferenceKey=conf()))
+
+    etags = {}
+
+    def conditional():
+        # poll one conference, presenting the etag of the last answer
+        wsck = confs[0].key.urlsafe()
+        etags[wsck] = api.getConference(stubs.request(CONF_ETAG_REQUEST,
+            websafeConferenceKey=wsck, ifNoneMatch=etags.get(wsck))).etag
+
+    def wishlist():
+        stubs.login(next(newUsers))
+        api.addToWishlist(stubs.request(WISHLIST_REQUEST,
+            sessionKey=rnd.choice(sessions).key.urlsafe()))
+
+    return [
+        ('queryConferences', lambda: api.queryConferences(
+            ConferenceQueryForms())),
+        ('queryConferences city', lambda: api.queryConferences(
+            ConferenceQueryForms(filters=[ConferenceQueryForm(
+                field='CITY', operator='EQ', value='City 1')]))),
+        ('queryConferences summary', lambda: api.queryConferences(
+            ConferenceQueryForms(view='summary'))),
+        ('getConference', lambda: api.getConference(
+            stubs.request(CONF_ETAG_REQUEST, websafeConferenceKey=conf()))),
+        ('getConference not modified', conditional),
+        ('getConferenceSessions', lambda: api.getConferenceSessions(
+            stubs.request(SESSION_GET_REQUEST, websafeConferenceKey=conf()))),
+        ('getSessionsBySpeaker', lambda: api.getSessionsBySpeaker(
+            stubs.request(SESSION_SPEAKER_POST_REQUEST,
+                speaker='Speaker %d' % rnd.randrange(10)))),
+        ('getConferencesToAttend', lambda: (user(),
+            api.getConferencesToAttend(full))),
+        ('getConferencesCreated', lambda: (user(),
+            api.getConferencesCreated(full))),
+        ('getConferencesCreated summary', lambda: (user(),
+            api.getConferencesCreated(summary))),
+        ('getSessionsInWishlist', lambda: (user(),
+            api.getSessionsInWishlist(void))),
+        ('lessThanFiveSeats', lambda: api.lessThanFiveSeats(void)),
+        ('registerForConference', register),
+        ('addSessionToWishlist', wishlist),
+    ]
+
+
+def measure(call, counter):
+    """Run call as one fresh request; return (ms, rpc counts)."""
+    from google.appengine.ext import ndb
+    ndb.get_context().clear_cache()
+    counter.start()
+    start = time.time()
+    call()
+    return 1000 * (time.time() - start), counter.stop()
+
+
+def report(name, timings, rpcs, hits, misses):
+    n = len(timings)
+    perCall = lambda calls: sum(c[('datastore_v3', call)]
+        for c in rpcs for call in calls) / float(n)
+    print('%-30s %5d %8.2f %8.2f %8.2f %6.1f %6.1f %6.1f %7s' % (name, n,
+        percentile(timings, 50), percentile(timings, 95), percentile(timings, 99),
+        perCall(['Get']), perCall(['Put', 'Commit']), perCall(['RunQuery', 'Next']),
+        '%.0f%%' % (100.0 * hits / (hits + misses)) if hits + misses else '-'))
+
+
+def runConcurrent(api, confs, counter, args):
+    """Register distinct users for one conference from many threads."""
+    from google.appengine.api import datastore_errors
+    from conference import CONF_GET_REQUEST
+    from models import ConflictException, TooManyRequestsException
+
+    wsck = confs[0].key.urlsafe()
+    timings, rpcs = [], []
+    rejected = defaultdict(int)
+    lock = threading.Lock()
+
+    def worker(n):
+        for i in range(args.iterations):
+            stubs.login('concurrent%d-%d@example.com' % (n, i))
+            try:
+                result = measure(lambda: api.registerForConference(
+                    stubs.request(CONF_GET_REQUEST, websafeConferenceKey=wsck)),
+                    counter)
+            except (ConflictException, TooManyRequestsException,
+                    datastore_errors.TransactionFailedError) as e:
+                with lock:
+                    rejected[type(e).__name__] += 1
+                continue
+            with lock:
+                timings.append(result[0])
+                rpcs.append(result[1])
+
+    threads = [threading.Thread(target=worker, args=(n,))
+        for n in range(args.concurrency)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    if timings:
+        report('register x%d threads' % args.concurrency, timings, rpcs, 0, 0)
+    print('%d registrations in %.2fs (%.1f/s)' % (len(timings), elapsed,
+        len(timings) / elapsed))
+    for name, count in sorted(rejected.items()):
+        print('%d rejected with %s' % (count, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--profiles', type=int, default=200)
+    parser.add_argument('--conferences', type=int, default=100)
+    parser.add_argument('--sessions', type=int, default=20,
+        help='sessions per conference')
+    parser.add_argument('--speakers', type=int, default=50)
+    parser.add_argument('--registrations', type=int, default=5,
+        help='conferences each profile attends')
+    parser.add_argument('--wishlist', type=int, default=10,
+        help='sessions in each profile wishlist')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=0)
+    parser.add_argument('--shards', type=int, default=0,
+        help='SEAT_SHARDS used for the concurrent registration run')
+    parser.add_argument('--only', help='comma separated endpoint names')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    stubs.setUp()
+    import conference
+    from google.appengine.api import apiproxy_stub_map
+    from google.appengine.api import memcache
+
+    counter = RpcCounter()
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('bench', counter.hook)
+
+    rnd = random.Random(args.seed)
+    profiles, confs, sessions = seed(args)
+    api = conference.ConferenceApi()
+    only = set(args.only.split(',')) if args.only else None
+
+    print('%-30s %5s %8s %8s %8s %6s %6s %6s %7s' % ('endpoint', 'n',
+        'p50 ms', 'p95 ms', 'p99 ms', 'gets', 'writes', 'query', 'mc hit'))
+    for name, call in scenarios(api, profiles, confs, sessions, rnd):
+        if only and name not in only:
+            continue
+        before = memcache.get_stats()
+        timings, rpcs = [], []
+        for _ in range(args.iterations):
+            ms, counts = measure(call, counter)
+            timings.append(ms)
+            rpcs.append(counts)
+        after = memcache.get_stats()
+        report(name, timings, rpcs, after['hits'] - before['hits'],
+            after['misses'] - before['misses'])
+
+    if args.concurrency:
+        from models import Conference, ConferenceForm
+        conference.SEAT_SHARDS = args.shards
+        stubs.login(confs[0].organizerUserId)
+        api._createConferenceObject(ConferenceForm(name='Concurrent',
+            maxAttendees=args.concurrency * args.iterations))
+        target = Conference.query(Conference.name == 'Concurrent').get()
+        runConcurrent(api, [target], counter, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""seat_shards.py -- registrations per second against seat shard count
+
+Registers --users distinct users for one conference from --threads
+concurrent threads, once per shard count, and checks that no seat was
+oversold. Registrations whose transaction failed under contention are
+counted separately.
+
+    python benchmarks/seat_shards.py --shards 0,1,5,10,20
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import threading
+import time
+
+import stubs
+
+
+def run(shards, users, threads):
+    tb = stubs.setUp()
+    from google.appengine.api import datastore_errors
+    from google.appengine.ext import ndb
+    import conference
+    import ratelimit
+    from conference import ConferenceApi, CONF_GET_REQUEST
+    from models import ConferenceForm, ConflictException
+
+    conference.SEAT_SHARDS = shards
+    # measure the seat inventory, not the conference rate limit
+    ratelimit.RATE_LIMITS['conference'] = (users, float(users))
+    api = ConferenceApi()
+    stubs.login('organizer@example.com')
+    api._createConferenceObject(ConferenceForm(
+        name='Flash sale', maxAttendees=users))
+    conf = conference.Conference.query().get()
+    wsck = conf.key.urlsafe()
+
+    emails = ['user%d@example.com' % i for i in range(users)]
+    registered, soldOut, failed = [], [], []
+
+    def worker(chunk):
+        for email in chunk:
+            stubs.login(email)
+            try:
+                api.registerForConference(
+                    stubs.request(CONF_GET_REQUEST, websafeConferenceKey=wsck))
+            except ConflictException:
+                soldOut.append(email)
+            except datastore_errors.TransactionFailedError:
+                failed.append(email)
+            else:
+                registered.append(email)
+
+    chunks = [emails[i::threads] for i in range(threads)]
+    pool = [threading.Thread(target=worker, args=(c,)) for c in chunks]
+    start = time.time()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.time() - start
+
+    # this thread's context cache still holds the entities put on creation
+    ndb.get_context().clear_cache()
+    ConferenceApi._syncSeatsAvailable(wsck)
+    ndb.get_context().clear_cache()
+    seats = conf.key.get().seatsAvailable
+    assert len(registered) + seats == users, 'oversold: %d + %d' % (
+        len(registered), seats)
+    tb.deactivate()
+    return len(registered) / elapsed, len(soldOut), len(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--shards', default='0,1,5,10,20')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=20)
+    args = parser.parse_args()
+
+    print('%8s %12s %10s %10s' % ('shards', 'regs/sec', 'rejected', 'failed'))
+    for shards in [int(n) for n in args.shards.split(',')]:
+        rate, rejected, failed = run(shards, args.users, args.threads)
+        print('%8d %12.1f %10d %10d' % (shards, rate, rejected, failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""stubs.py -- local App Engine service stubs shared by the benchmarks
+
+Set APPENGINE_SDK to the Python SDK directory (the one holding
+dev_appserver.py) and run a benchmark from the repo root, e.g.
+
+    python benchmarks/seat_shards.py
+
+"""
+
+import os
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SDK = os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine')
+
+_local = threading.local()
+
+
+def setUp():
+    """Activate a testbed with datastore, memcache, taskqueue & friends."""
+    sys.path.insert(0, SDK)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(root_path=ROOT,
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    tb.init_urlfetch_stub()
+    tb.init_mail_stub()
+    tb.init_app_identity_stub()
+
+    # os.environ is process wide here, so keep the signed in user per
+    # thread to let concurrent benchmarks act as different users
+    import endpoints
+    endpoints.get_current_user = lambda: getattr(_local, 'user', None)
+    login('organizer@example.com')
+    return tb
+
+
+def login(email):
+    """Sign the current thread in as email."""
+    from google.appengine.api import users
+    _local.user = users.User(email, 'example.com')
+
+
+def request(container, **fields):
+    """Build the combined request message of a ResourceContainer."""
+    return container.combined_message_class(**fields)
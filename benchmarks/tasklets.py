@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""tasklets.py -- wall clock of blocking vs tasklet read endpoints
+
+Adds --latency ms to every datastore RPC of the local stub, then times
+the old blocking call sequences (profile get, conference get_multi,
+organiser get_multi, one after the other) against the tasklet based
+getConferencesToAttend, getConferencesCreated, getConference and
+queryConferences. Conferences are stored without organizerDisplayName
+so the organiser lookups still happen, as for data written before it
+was denormalized.
+
+    python benchmarks/tasklets.py --latency 20
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+import stubs
+from harness import percentile
+
+
+def slowDatastore(latency):
+    """Delay every datastore stub call by latency seconds."""
+    from google.appengine.api import apiproxy_stub_map
+    stub = apiproxy_stub_map.apiproxy.GetStub('datastore_v3')
+    makeSyncCall = stub.MakeSyncCall
+
+    def delayed(*args, **kwargs):
+        time.sleep(latency)
+        return makeSyncCall(*args, **kwargs)
+    stub.MakeSyncCall = delayed
+
+
+def blockingForms(api, confs):
+    """The pre-tasklet rendering: organisers fetched after all conferences."""
+    from google.appengine.ext import ndb
+    from models import Profile
+    confs = [c for c in confs if c]
+    profiles = ndb.get_multi([ndb.Key(Profile, c.organizerUserId) for c in confs])
+    names = dict((p.key.id(), p.displayName) for p in profiles if p)
+    return [api._copyConferenceToForm(c, names.get(c.organizerUserId)) for c in confs]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--latency', type=float, default=20)
+    parser.add_argument('--conferences', type=int, default=50)
+    parser.add_argument('--organizers', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    stubs.setUp()
+    from google.appengine.ext import ndb
+    from conference import ConferenceApi, CONF_LIST_REQUEST
+    from models import Conference, ConferenceQueryForms, Profile
+
+    organizers = [Profile(id='org%d@example.com' % i, displayName='Org %d' % i)
+        for i in range(args.organizers)]
+    attendee = Profile(id='attendee@example.com', displayName='Attendee')
+    confs = [Conference(parent=organizers[i % args.organizers].key,
+        name='Conference %d' % i, organizerUserId=organizers[i % args.organizers].key.id(),
+        city='City', maxAttendees=10, seatsAvailable=10)
+        for i in range(args.conferences)]
+    ndb.put_multi(organizers + confs)
+    for conf in confs:
+        attendee.addConference(conf.key)
+    attendee.put()
+
+    api = ConferenceApi()
+    lists = stubs.request(CONF_LIST_REQUEST)
+    wsck = confs[0].key.urlsafe()
+    owner = organizers[0].key
+
+    def oldAttending():
+        prof = attendee.key.get()
+        return blockingForms(api, ndb.get_multi(prof.conferencesToAttend))
+
+    def oldCreated():
+        confs = Conference.query(ancestor=owner).fetch()
+        return blockingForms(api, confs)
+
+    def oldGetConference():
+        conf = ndb.Key(urlsafe=wsck).get()
+        prof = conf.key.parent().get()
+        return api._copyConferenceToForm(conf, prof.displayName)
+
+    def oldQuery():
+        confs = Conference.query().order(Conference.name).fetch(20)
+        return blockingForms(api, confs)
+
+    def newGetConference():
+        # skip the rendered-form cache to time the datastore path
+        return api._conferenceFormAsync(ndb.Key(urlsafe=wsck), {}).get_result()
+
+    cases = [
+        ('getConferencesToAttend', 'attendee@example.com', oldAttending,
+            lambda: api.getConferencesToAttend(lists)),
+        ('getConferencesCreated', owner.id(), oldCreated,
+            lambda: api.getConferencesCreated(lists)),
+        ('getConference', None, oldGetConference, newGetConference),
+        ('queryConferences', None, oldQuery,
+            lambda: api.queryConferences(ConferenceQueryForms(pageSize=20))),
+    ]
+
+    slowDatastore(args.latency / 1000.0)
+    print('%-24s %12s %12s' % ('endpoint', 'before p50', 'after p50'))
+    for name, user, old, new in cases:
+        if user:
+            stubs.login(user)
+        timings = {}
+        for label, call in (('old', old), ('new', new)):
+            timings[label] = []
+            for _ in range(args.iterations):
+                ndb.get_context().clear_cache()
+                start = time.time()
+                call()
+                timings[label].append(1000 * (time.time() - start))
+        print('%-24s %10.1fms %10.1fms' % (name,
+            percentile(timings['old'], 50), percentile(timings['new'], 50)))
+
+
+if __name__ == '__main__':
+    main()
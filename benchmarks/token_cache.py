@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+"""token_cache.py -- tokeninfo calls, hit rate and latency of getUserId
+
+Replays --calls OAuth getUserId calls spread over --tokens distinct
+tokens (a tenth of them invalid) against a local stand-in for urlfetch
+that answers after --latency ms, and reports how many network calls
+were made and the per-call latency.
+
+    python benchmarks/token_cache.py --calls 5000 --tokens 50
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import time
+
+import stubs
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+class FakeUrlfetch(object):
+    """Stand-in for google.appengine.api.urlfetch's tokeninfo answers."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def fetch(self, url):
+        self.calls += 1
+        time.sleep(self.latency)
+        token = url.rsplit('=', 1)[1]
+        if token.startswith('bad'):
+            return FakeResponse(400, '{"error": "invalid_token"}')
+        return FakeResponse(200, json.dumps(
+            {'user_id': 'uid-' + token, 'expires_in': 3600}))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--calls', type=int, default=5000)
+    parser.add_argument('--tokens', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=50)
+    args = parser.parse_args()
+
+    stubs.setUp()
+    import utils
+    fake = utils.urlfetch = FakeUrlfetch(args.latency / 1000.0)
+
+    tokens = [('bad%d' if i % 10 == 9 else 'tok%d') % i
+        for i in range(args.tokens)]
+    timings = []
+    for _ in range(args.calls):
+        os.environ['HTTP_AUTHORIZATION'] = 'Bearer ' + random.choice(tokens)
+        start = time.time()
+        utils.getUserId(None, id_type='oauth')
+        timings.append(1000 * (time.time() - start))
+
+    print('calls %d, tokeninfo fetches %d, hit rate %.1f%%' % (args.calls,
+        fake.calls, 100.0 * (args.calls - fake.calls) / args.calls))
+    print('latency ms  p50 %.2f  p95 %.2f  p99 %.2f  max %.2f' % (
+        percentile(timings, 50), percentile(timings, 95),
+        percentile(timings, 99), max(timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""caching.py -- versioned memcache entries with an optional in-process LRU
+
+Every cached value is stored together with the version it was built
+from. Writers bump the version once their datastore write has committed,
+which makes any entry built from older data unreachable without having
+to find and delete it.
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+
+
+class LRUCache(object):
+    """LRUCache -- thread-safe in-process LRU with optional expiry"""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value cached for key, or None."""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None:
+                return None
+            value, expires = item
+            if expires and expires <= time.time():
+                return None
+            self._items[key] = item
+            return value
+
+    def set(self, key, value, expires=None):
+        """Cache value for key until the expires timestamp, if given."""
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, expires)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        """Drop key from the cache."""
+        with self._lock:
+            self._items.pop(key, None)
+
+
+def _newVersion(versionKey):
+    """Start a version counter; time based so it never repeats one that
+    was evicted from memcache."""
+    version = int(time.time() * 1000)
+    if memcache.add(versionKey, version):
+        return version
+    return memcache.get(versionKey) or version
+
+
+def getVersion(versionKey):
+    """Return the current version stored under versionKey."""
+    return memcache.get(versionKey) or _newVersion(versionKey)
+
+
+def bumpVersion(versionKey):
+    """Invalidate everything cached under versionKey; returns the new
+    version."""
+    version = memcache.incr(versionKey)
+    if version is None:
+        version = _newVersion(versionKey)
+    return version
+
+
+def setVersionedIfChanged(key, versionKey, value):
+    """Cache value under a new version unless it is already the cached
+    value; returns the version it is cached under."""
+    version, current = getVersioned(key, versionKey)
+    if current != value:
+        version = bumpVersion(versionKey)
+        setVersioned(key, version, value)
+    return version
+
+
+def getVersioned(key, versionKey, lru=None):
+    """Return (version, value); value is None unless it was cached for
+    the current version."""
+    if lru is None:
+        # one round trip for both the version and the value
+        found = memcache.get_multi([versionKey, key])
+        version = found.get(versionKey)
+        if version is None:
+            return _newVersion(versionKey), None
+        entry = found.get(key)
+    else:
+        version = getVersion(versionKey)
+        entry = lru.get(key)
+        if not entry or entry[0] != version:
+            entry = memcache.get(key)
+            if entry and entry[0] == version:
+                lru.set(key, entry)
+    if entry and entry[0] == version:
+        return version, entry[1]
+    return version, None
+
+
+def setVersioned(key, version, value, lru=None):
+    """Cache value as built from the given version."""
+    memcache.set(key, (version, value))
+    if lru is not None:
+        lru.set(key, (version, value))
@@ -13,34 +13,84 @@ created by wesc on 2014 apr 21
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 from datetime import datetime
+from datetime import timedelta
+import heapq
+import json
+import logging
+import random
+import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protojson
 from protorpc import remote
 
-from google.appengine.api import memcache
+from google.appengine.api import app_identity
+from google.appengine.api import datastore_errors
+from google.appengine.api import mail
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 from models import *
 
+import caching
+import planner
+import textindex
+from instrumentation import instrumented
+from ratelimit import ratelimited
 from utils import getUserId
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
 from settings import IOS_CLIENT_ID
 from settings import ANDROID_AUDIENCE
+from settings import SEAT_SHARDS
+from settings import SEAT_SYNC_INTERVAL
+from settings import CONFERENCE_LRU_SIZE
 
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_ANNOUNCEMENTS_VERSION_KEY = "RECENT_ANNOUNCEMENTS_VERSION"
+MEMCACHE_FEATURED_SPEAKER_VERSION_KEY = "FEATURED_SPEAKER_VERSION"
+MEMCACHE_CONFERENCE_KEY = "CONFERENCE:%s"
+MEMCACHE_CONFERENCE_VERSION_KEY = "CONFERENCE_VERSION:%s"
+MEMCACHE_SESSIONS_KEY = "SESSIONS:%s:%s"
+MEMCACHE_SESSIONS_VERSION_KEY = "SESSIONS_VERSION:%s"
+MEMCACHE_SCHEDULE_KEY = "SCHEDULE:%s"
+MEMCACHE_TOP_SPEAKERS_KEY = "TOP_SPEAKERS:%s"
+MEMCACHE_SCHEDULE_VERSION_KEY = "SCHEDULE_VERSION:%s"
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+NEARLY_SOLD_OUT_SEATS = 5
+NEARLY_SOLD_OUT_KEY = ndb.Key(NearlySoldOut, 'announcement')
+QUERY_PAGE_SIZE = 20
+QUERY_MAX_PAGE_SIZE = 100
+QUERY_MAX_SCAN = 1000
+TOP_SPEAKERS = 10
+TOP_SPEAKERS_MAX = 100
+CONFIRMATION_QUEUE = 'confirmation-email'
+SEARCH_MAX_RESULTS = 1000
+# properties a ConferenceSummaryForm is built from
+SUMMARY_PROPERTIES = ('name', 'city', 'startDate', 'endDate', 'seatsAvailable')
+CONFIRMATION_LEASE = 300
+CONFIRMATION_TIME_BUDGET = 50
+# sessions plus their SessionIndex must fit in one transaction's writes
+CREATE_SESSIONS_MAX = 400
+# createSessions takes one rate limit token per this many sessions
+SESSIONS_PER_TOKEN = 20
+# Speaker aggregates updated in the transaction storing a batch of
+# sessions; with the conference, SessionIndex and SpeakerBoard that stays
+# under the 25 entity groups of a cross-group transaction
+SPEAKERS_PER_TRANSACTION = 20
 FEATURED_SPEAKER_TPL = ('Check out our latest featured speaker, %s! %s feaures in the following sessions: %s')
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+CONFERENCE_LRU = caching.LRUCache(CONFERENCE_LRU_SIZE) if CONFERENCE_LRU_SIZE else None
+
 DEFAULTS = {
     "city": "Default City",
     "maxAttendees": 0,
@@ -62,6 +112,12 @@ OPERATORS = {
             'NE':   '!='
             }
 
+SEARCH_KINDS = {
+            'ALL': ['Conference', 'Session'],
+            'CONFERENCE': ['Conference'],
+            'SESSION': ['Session'],
+            }
+
 FIELDS =    {
             'CITY': 'city',
             'TOPIC': 'topics',
@@ -74,6 +130,17 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_ETAG_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+)
+
+ETAG_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -100,12 +167,104 @@ SESSION_SPEAKER_POST_REQUEST = endpoints.ResourceContainer(
     speaker=messages.StringField(1),
 )
 
+SESSION_SEARCH_REQUEST = endpoints.ResourceContainer(
+    SessionSearchForm,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+SESSION_BULK_POST_REQUEST = endpoints.ResourceContainer(
+    SessionCreateForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    q=messages.StringField(1),
+    kind=messages.StringField(2),
+    pageSize=messages.IntegerField(3),
+    pageToken=messages.StringField(4),
+)
+
+CONF_LIST_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    view=messages.StringField(1),
+)
+
+TOP_SPEAKERS_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    limit=messages.IntegerField(2),
+)
+
 WISHLIST_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     sessionKey=messages.StringField(1),
 )
 
 
+# - - - Form copiers - - - - - - - - - - - - - - - - - - - - -
+def _formCopier(formClass, modelClass, convert):
+    """Build a function copying an entity of modelClass into formClass.
+
+    Which fields are copied straight across and which go through a
+    converter (a function of the entity, keyed by field name in convert)
+    is worked out once here instead of on every copy.
+    """
+    plain = []
+    converted = []
+    for field in formClass.all_fields():
+        if field.name in convert:
+            converted.append((field.name, convert[field.name]))
+        elif isinstance(getattr(modelClass, field.name, None), ndb.Property):
+            plain.append(field.name)
+
+    def copy(entity):
+        form = formClass()
+        for name in plain:
+            setattr(form, name, getattr(entity, name))
+        for name, convertField in converted:
+            setattr(form, name, convertField(entity))
+        return form
+    return copy
+
+
+copySessionToForm = _formCopier(SessionForm, Session, {
+    'dateTime': lambda s: s.dateTime.strftime('%y-%m-%d') if s.dateTime else None,
+    'typeOfSession': lambda s: getattr(SessionType,
+        str(s.typeOfSession) if s.typeOfSession else 'NOT_SPECIFIED'),
+    'websafeSessionKey': lambda s: s.key.urlsafe(),
+})
+
+# dates go out as strings (None as 'None', as they always have)
+copyConferenceToForm = _formCopier(ConferenceForm, Conference, {
+    'startDate': lambda c: str(c.startDate),
+    'endDate': lambda c: str(c.endDate),
+    'websafeKey': lambda c: c.key.urlsafe(),
+})
+
+def copyConferenceToSummaryForm(conf, known=None):
+    """Copy the summary fields of a (possibly projected) Conference to a
+    ConferenceSummaryForm; known holds values the projection left out."""
+    known = known or {}
+    value = lambda name: known[name] if name in known else getattr(conf, name)
+    return ConferenceSummaryForm(name=value('name'), city=value('city'),
+        startDate=str(value('startDate')), endDate=str(value('endDate')),
+        seatsAvailable=value('seatsAvailable'), websafeKey=conf.key.urlsafe())
+
+copyProfileToForm = _formCopier(ProfileForm, Profile, {
+    'teeShirtSize': lambda p: getattr(TeeShirtSize, p.teeShirtSize),
+})
+
+
+def _wishlistConference(request):
+    """Return the websafe key of the conference of a wishlist request's
+    session, or None for a malformed key (the endpoint reports that)."""
+    try:
+        return ndb.Key(urlsafe=request.sessionKey).parent().urlsafe()
+    except Exception:
+        return None
+
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 @endpoints.api(name='conference', version='v1', 
     allowed_client_ids=[WEB_CLIENT_ID, API_EXPLORER_CLIENT_ID, ANDROID_CLIENT_ID, IOS_CLIENT_ID],
@@ -117,77 +276,78 @@ class ConferenceApi(remote.Service):
 # - - - Session objects - - - - - - - - - - - - - - - - - - -
     def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm!"""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                if field.name == "dateTime":
-                    s_date = getattr(session,field.name)
-                    if s_date:
-                        setattr(sf, 'dateTime', s_date.strftime('%y-%m-%d'))
-                        setattr(sf, 'startTime', s_date.strftime('%H:%M'))
-
-                elif field.name == "speaker":
-                    speaker = getattr(session,field.name)
-                    setattr(sf, 'speaker', speaker)
-
-                elif field.name == "typeOfSession":
-                    currentType = getattr(session,field.name)
-                    if currentType:
-                        setattr(sf, field.name, getattr(SessionType, str(currentType)))
-                    else:
-                        setattr(sf, field.name, getattr(SessionType, 'NOT_SPECIFIED'))
-                else:
-                    setattr(sf, field.name, getattr(session,field.name))
-
-            if field.name == "websafeSessionKey":
-                setattr(sf, field.name, session.key.urlsafe())
-        sf.check_initialized()
-        return sf
-        
-        
+        return copySessionToForm(session)
+
+
     @endpoints.method(SESSION_GET_REQUEST, SessionForms,
             path='getConferenceSessions/{websafeConferenceKey}',
             http_method='POST', name='getConferenceSessions')
+    @instrumented
     def getConferenceSessions(self, request):
         """Return all sessions in a conference!"""
-        # get the conference from the websafeConferenceKey
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
-        # query sessions by websafeConferenceKey
-        sessions = Session.query(ancestor=conf.key)
-        return SessionForms(items=[self._copySessionToForm(session) 
-            for session in sessions])
+        return self._cachedSessionForms(request.websafeConferenceKey, None)
         
         
     @endpoints.method(SESSION_TYPE_POST_REQUEST, SessionForms,
             path='getConferenceSessions/{websafeConferenceKey}/{typeOfSession}',
             http_method='POST', name='getConferenceSessionsByType')
+    @instrumented
     def getConferenceSessionsByType(self, request):
         """Return sessions in a conference queried by type!"""
-        # get the conference from the websafeConferenceKey
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
-        # query sessions
-        sessions = Session.query(ancestor=conf.key)
-        # filter sessions by type
-        sessionsbyType = sessions.filter(Session.typeOfSession == request.typeOfSession)
-        return SessionForms(items=[self._copySessionToForm(session) 
-            for session in sessionsbyType])
+        return self._cachedSessionForms(request.websafeConferenceKey,
+            request.typeOfSession)
+
+
+    def _cachedSessionForms(self, wsck, typeOfSession):
+        """Return the sessions of a conference, optionally of one type,
+        from the rendered list cached for the conference's sessions
+        version, or query and cache them."""
+        cacheKey = MEMCACHE_SESSIONS_KEY % (wsck, typeOfSession or '')
+        version, cached = caching.getVersioned(cacheKey,
+            MEMCACHE_SESSIONS_VERSION_KEY % wsck)
+        if cached is not None:
+            return protojson.decode_message(SessionForms, cached)
+
+        # query sessions by websafeConferenceKey (and type)
+        sessions = Session.query(ancestor=ndb.Key(urlsafe=wsck))
+        if typeOfSession:
+            sessions = sessions.filter(Session.typeOfSession == typeOfSession)
+        forms = SessionForms(items=[self._copySessionToForm(session)
+            for session in sessions])
+        caching.setVersioned(cacheKey, version, protojson.encode_message(forms))
+        return forms
+
+
+    @staticmethod
+    def _invalidateSessions(wsck):
+        """Make cached session lists of a conference unreachable; call only
+        once the write has committed."""
+        caching.bumpVersion(MEMCACHE_SESSIONS_VERSION_KEY % wsck)
         
         
     @endpoints.method(SESSION_SPEAKER_POST_REQUEST, SessionForms,
             path='getSpeakerSessions/{speaker}',
             http_method='POST', name='getSessionsBySpeaker')
+    @instrumented
     def getSessionsBySpeaker(self, request):
         """Return sessions in a conference queried by speaker!"""
-        # query sessions by requested speaker
-        sessions = Session.query(Session.speaker == request.speaker)
+        # read the speaker's session keys from its aggregate
+        speaker = None
+        if request.speaker != SESSION_DEFAULTS['speaker']:
+            speaker = ndb.Key(Speaker, request.speaker).get()
+        if speaker and speaker.seeded:
+            sessions = [s for s in ndb.get_multi(speaker.sessionKeys) if s]
+        else:
+            # no session added since aggregates were kept, the aggregate
+            # is still being seeded, or the speaker is the default one
+            sessions = Session.query(Session.speaker == request.speaker)
         return SessionForms(items=[self._copySessionToForm(session) 
             for session in sessions])
 
 
-    def _createSessionObject(self, request):
-        """Create or update a Session object, returning SessionForm/request!"""
+    def _sessionConference(self, wsck):
+        """Return the conference sessions are added to, checking that the
+        current user is logged in and owns it."""
         user = endpoints.get_current_user()
 
         # require user to be registered and logged in to add a session
@@ -195,31 +355,40 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException("Please log in to create a Session!")
         user_id = getUserId(user)
 
-        # session must be given at least a name
-        if not request.name:
-            raise endpoints.BadRequestException("You must input a Session Name!")
         # session must be given a websafeConferenceKey
-        if not request.websafeConferenceKey:
+        if not wsck:
             raise endpoints.BadRequestException("You must input a Conference Key!")
 
         # fetch and check conference
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
 
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference exists with key: %s' % request.websafeConferenceKey)
+                'No conference exists with key: %s' % wsck)
 
         # validate that user is owner of conference
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
-                'You must be the Conference owner to create a session!')    
+                'You must be the Conference owner to create a session!')
+        return conf
+
+
+    def _sessionFromForm(self, request, s_key):
+        """Build (but don't store) the Session described by a SessionForm,
+        filling the form's defaults in as well."""
+        # session must be given at least a name
+        if not request.name:
+            raise endpoints.BadRequestException("You must input a Session Name!")
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
 
         # convert date and time fields to the correct types
         if data['dateTime']:
-            s_date = datetime.strptime(data['dateTime'], '%Y-%m-%d %H:%M')
+            try:
+                s_date = datetime.strptime(data['dateTime'], '%Y-%m-%d %H:%M')
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "dateTime must be given as YYYY-MM-DD HH:MM")
             data['dateTime'] = s_date
             data['startTime'] = datetime.strftime(s_date, '%H:%M')
 
@@ -236,13 +405,19 @@ class ConferenceApi(remote.Service):
             if data[df] in (None, []):
                 data[df] = SESSION_DEFAULTS[df]
                 setattr(request, df, SESSION_DEFAULTS[df])
-        
-        s_id = Conference.allocate_ids(size=1, parent=conf.key)[0]
-        s_key = ndb.Key(Session, s_id, parent=conf.key)
-        
+
         data['key'] = s_key
-        
-        Session(**data).put()
+        return Session(**data)
+
+
+    def _createSessionObject(self, request):
+        """Create or update a Session object, returning SessionForm/request!"""
+        conf = self._sessionConference(request.websafeConferenceKey)
+
+        s_id = Session.allocate_ids(size=1, parent=conf.key)[0]
+        s_key = ndb.Key(Session, s_id, parent=conf.key)
+        session = self._sessionFromForm(request, s_key)
+        self._putSessionWithSpeaker(session)
 
         if request.speaker:
             taskqueue.add(params={'speaker': request.speaker},
@@ -251,33 +426,504 @@ class ConferenceApi(remote.Service):
         return request
         
     
+    @staticmethod
+    def _bySpeaker(sessions):
+        """Group sessions by speaker; sessions whose speaker was left blank
+        or defaulted get no Speaker aggregate."""
+        bySpeaker = {}
+        for session in sessions:
+            if session.speaker and session.speaker != SESSION_DEFAULTS['speaker']:
+                bySpeaker.setdefault(session.speaker, []).append(session)
+        return bySpeaker
+
+
+    @staticmethod
+    def _addSpeakerSessions(speaker, sessions):
+        """Add the sessions not on a Speaker aggregate yet to it."""
+        known = set(speaker.sessionKeys)
+        for s in sessions:
+            if s.key not in known:
+                known.add(s.key)
+                speaker.sessionKeys.append(s.key)
+                speaker.sessionNames.append(s.name)
+        speaker.sessionCount = len(speaker.sessionKeys)
+
+
+    @staticmethod
+    def _speakersWith(bySpeaker):
+        """Return the Speaker aggregates of {name: sessions} with the
+        sessions added; the caller stores them in its transaction. New
+        aggregates get older sessions from one seed_speakers task."""
+        sp_keys = [ndb.Key(Speaker, name) for name in bySpeaker]
+        speakers = ndb.get_multi(sp_keys)
+        new = []
+        for i, sp_key in enumerate(sp_keys):
+            if not speakers[i]:
+                speakers[i] = Speaker(key=sp_key, seeded=False)
+                new.append(sp_key.id())
+            ConferenceApi._addSpeakerSessions(speakers[i],
+                bySpeaker[sp_key.id()])
+        if new:
+            taskqueue.add(params={'speaker': new}, url='/tasks/seed_speakers',
+                transactional=ndb.in_transaction())
+        return speakers
+
+
+    @staticmethod
+    def _seedSpeakers(names):
+        """Add the sessions given before their Speaker aggregates existed;
+        used by the seed_speakers task. Sessions stored since then are on
+        the aggregate already, so the query lagging behind them is fine."""
+        for name in names:
+            ConferenceApi._seedSpeaker(name,
+                Session.query(Session.speaker == name).fetch())
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _seedSpeaker(name, sessions):
+        """Add sessions to an unseeded Speaker aggregate and mark it seeded."""
+        speaker = ndb.Key(Speaker, name).get()
+        if speaker and not speaker.seeded:
+            ConferenceApi._addSpeakerSessions(speaker, sessions)
+            speaker.seeded = True
+            speaker.put()
+
+
+    @ndb.transactional(xg=True)
+    def _putSessionWithSpeaker(self, session):
+        """Store a Session, count it on its Speaker and add it to its
+        conference's SessionIndex and SpeakerBoard in one transaction"""
+        index = self._sessionIndex(session.key.parent())
+        self._indexSession(index, session)
+        board = self._speakerBoard(session.key.parent())
+        self._rankSpeakers(board, [session])
+        speakers = self._speakersWith(self._bySpeaker([session]))
+        ndb.put_multi([session, index, board] + speakers)
+        self._queueIndexing([session.key])
+        wsck = session.key.parent().urlsafe()
+        ndb.get_context().call_on_commit(
+            lambda: self._invalidateSessions(wsck))
+
+
     @endpoints.method(SessionForm, SessionForm, 
             path='createSession', http_method='POST', 
             name='createSession')
+    @instrumented
+    @ratelimited(lambda request: request.websafeConferenceKey)
     def createSession(self, request):
         """Create a new Session!"""
         return self._createSessionObject(request)           
 
-    
+
+    @ndb.transactional(xg=True)
+    def _putSessions(self, c_key, sessions):
+        """Store sessions of one conference and add them to its
+        SessionIndex, SpeakerBoard and Speakers in one transaction;
+        returns False if the Speakers were left to a task"""
+        index = self._sessionIndex(c_key)
+        for session in sessions:
+            self._indexSession(index, session)
+        board = self._speakerBoard(c_key)
+        self._rankSpeakers(board, sessions)
+        entities = sessions + [index, board]
+        bySpeaker = self._bySpeaker(sessions)
+        counted = len(bySpeaker) <= SPEAKERS_PER_TRANSACTION
+        if counted:
+            entities += self._speakersWith(bySpeaker)
+        else:
+            # too many entity groups; one task counts them once committed
+            taskqueue.add(params={'websafeSessionKey':
+                [session.key.urlsafe() for session in sessions]},
+                url='/tasks/count_speaker_sessions', transactional=True)
+        ndb.put_multi(entities)
+        self._queueIndexing([session.key for session in sessions])
+        ndb.get_context().call_on_commit(
+            lambda: self._invalidateSessions(c_key.urlsafe()))
+        return counted
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _putSpeakerSessions(bySpeaker):
+        """Count sessions on their Speaker aggregates"""
+        ndb.put_multi(ConferenceApi._speakersWith(bySpeaker))
+
+
+    @staticmethod
+    def _countSpeakerSessions(websafeKeys):
+        """Count stored sessions on their Speaker aggregates, a transaction
+        per SPEAKERS_PER_TRANSACTION speakers, then queue their featured
+        speaker tasks; used by the count_speaker_sessions task and safe to
+        run more than once."""
+        sessions = ndb.get_multi([ndb.Key(urlsafe=k) for k in websafeKeys])
+        bySpeaker = ConferenceApi._bySpeaker([s for s in sessions if s])
+        names = sorted(bySpeaker)
+        for i in range(0, len(names), SPEAKERS_PER_TRANSACTION):
+            ConferenceApi._putSpeakerSessions(dict((name, bySpeaker[name])
+                for name in names[i:i + SPEAKERS_PER_TRANSACTION]))
+        ConferenceApi._queueFeaturedSpeakers(names)
+
+
+    @staticmethod
+    def _queueFeaturedSpeakers(names):
+        """Queue one featured speaker task per speaker, added in batches."""
+        tasks = [taskqueue.Task(params={'speaker': name},
+            url='/tasks/set_featured_speaker') for name in names]
+        queue = taskqueue.Queue()
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+
+
+    @endpoints.method(SESSION_BULK_POST_REQUEST, SessionCreateResults,
+            path='createSessions/{websafeConferenceKey}',
+            http_method='POST', name='createSessions')
+    @instrumented
+    @ratelimited(lambda request: request.websafeConferenceKey,
+        cost=lambda request: (len(request.items) + SESSIONS_PER_TOKEN - 1)
+            // SESSIONS_PER_TOKEN or 1)
+    def createSessions(self, request):
+        """Create many Sessions in a conference at once!"""
+        if len(request.items) > CREATE_SESSIONS_MAX:
+            raise endpoints.BadRequestException(
+                'At most %d sessions can be created at once' % CREATE_SESSIONS_MAX)
+        conf = self._sessionConference(request.websafeConferenceKey)
+
+        # one id allocation for the whole batch
+        results = [SessionCreateResult() for _ in request.items]
+        if request.items:
+            first, _ = Session.allocate_ids(size=len(request.items),
+                parent=conf.key)
+        sessions = []
+        for i, form in enumerate(request.items):
+            s_key = ndb.Key(Session, first + i, parent=conf.key)
+            try:
+                sessions.append(self._sessionFromForm(form, s_key))
+            except endpoints.BadRequestException as e:
+                results[i].error = str(e)
+                continue
+            results[i].session = form
+        if not sessions:
+            return SessionCreateResults(items=results)
+
+        # featured speaker tasks go out once the speakers are counted,
+        # by the count_speaker_sessions task if they were left to it
+        if self._putSessions(conf.key, sessions):
+            self._queueFeaturedSpeakers(self._bySpeaker(sessions))
+
+        for result, session in zip(
+                [r for r in results if r.session is not None], sessions):
+            result.session = self._copySessionToForm(session)
+            result.session.websafeConferenceKey = request.websafeConferenceKey
+        return SessionCreateResults(items=results)
+
+        
+# - - - Speaker leaderboard - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _rankSpeakers(board, sessions):
+        """Count sessions on a SpeakerBoard and re-rank it; sessions with
+        a blank or defaulted speaker aren't ranked."""
+        counts = dict(board.ranking or [])
+        # boards stored before the default speaker was left out
+        counts.pop(SESSION_DEFAULTS['speaker'], None)
+        for speaker, spoken in ConferenceApi._bySpeaker(sessions).iteritems():
+            counts[speaker] = counts.get(speaker, 0) + len(spoken)
+        board.ranking = sorted(([speaker, count]
+            for speaker, count in counts.iteritems()),
+            key=lambda row: (-row[1], row[0]))
+
+
+    @staticmethod
+    def _speakerBoard(c_key):
+        """Return the SpeakerBoard of a conference, building it from the
+        conference's sessions if it has not been stored yet."""
+        board = ndb.Key(SpeakerBoard, c_key.urlsafe()).get()
+        if board is None:
+            board = SpeakerBoard(id=c_key.urlsafe(), ranking=[])
+            ConferenceApi._rankSpeakers(board,
+                Session.query(ancestor=c_key).fetch())
+        return board
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _storeSpeakerBoard(c_key):
+        """Build and store the SpeakerBoard of a conference with sessions
+        from before boards were kept."""
+        if not c_key.get():
+            raise endpoints.NotFoundException(
+                'No conference exists with key: %s' % c_key.urlsafe())
+        board = ConferenceApi._speakerBoard(c_key)
+        board.put()
+        return board
+
+
+    @endpoints.method(TOP_SPEAKERS_REQUEST, SpeakerRankForms,
+            path='conference/{websafeConferenceKey}/speakers',
+            http_method='GET', name='getTopSpeakers')
+    @instrumented
+    def getTopSpeakers(self, request):
+        """Return the speakers with the most sessions in a conference!"""
+        limit = request.limit or TOP_SPEAKERS
+        if not 0 < limit <= TOP_SPEAKERS_MAX:
+            raise endpoints.BadRequestException(
+                'limit must be between 1 and %d' % TOP_SPEAKERS_MAX)
+        wsck = request.websafeConferenceKey
+        c_key = ndb.Key(urlsafe=wsck)
+        if c_key.kind() != 'Conference':
+            raise endpoints.NotFoundException(
+                'No conference exists with key: %s' % wsck)
+
+        # the ranking changes only with the conference's sessions
+        cacheKey = MEMCACHE_TOP_SPEAKERS_KEY % wsck
+        version, ranking = caching.getVersioned(cacheKey,
+            MEMCACHE_SESSIONS_VERSION_KEY % wsck)
+        if ranking is None:
+            board = (ndb.Key(SpeakerBoard, wsck).get() or
+                self._storeSpeakerBoard(c_key))
+            ranking = [row for row in board.ranking or []
+                if row[0] != SESSION_DEFAULTS['speaker']]
+            caching.setVersioned(cacheKey, version, ranking)
+        return SpeakerRankForms(items=[SpeakerRankForm(speaker=speaker,
+            sessionCount=count) for speaker, count in ranking[:limit]])
+
+
+# - - - Session search - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _sessionBucket(session):
+        """Return the SessionIndex bucket and row of a session."""
+        if not session.dateTime:
+            return '', [session.key.id(), None, session.duration,
+                session.typeOfSession]
+        return session.dateTime.strftime('%Y-%m-%d %H'), [session.key.id(),
+            session.dateTime.hour * 60 + session.dateTime.minute,
+            session.duration, session.typeOfSession]
+
+
+    @staticmethod
+    def _indexSession(index, session):
+        """Add a session to a SessionIndex, keeping each bucket sorted."""
+        bucket, row = ConferenceApi._sessionBucket(session)
+        buckets = index.buckets or {}
+        buckets.setdefault(bucket, []).append(row)
+        buckets[bucket].sort(key=lambda r: r[1])
+        index.buckets = buckets
+
+
+    @staticmethod
+    def _sessionIndex(c_key):
+        """Return the SessionIndex of a conference, building it from the
+        conference's sessions if it has not been stored yet."""
+        index = ndb.Key(SessionIndex, c_key.urlsafe()).get()
+        if index is None:
+            index = SessionIndex(id=c_key.urlsafe(), buckets={})
+            for session in Session.query(ancestor=c_key):
+                ConferenceApi._indexSession(index, session)
+        return index
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _storeSessionIndex(c_key):
+        """Build and store the SessionIndex of a conference with sessions
+        from before indexes were kept."""
+        if not c_key.get():
+            raise endpoints.NotFoundException(
+                'No conference exists with key: %s' % c_key.urlsafe())
+        index = ConferenceApi._sessionIndex(c_key)
+        index.put()
+        return index
+
+
+    @staticmethod
+    def _minuteOfDay(value, name):
+        """Parse an 'HH:MM' request field into minutes after midnight."""
+        try:
+            when = datetime.strptime(value, '%H:%M')
+        except ValueError:
+            raise endpoints.BadRequestException(
+                '%s must be given as HH:MM' % name)
+        return when.hour * 60 + when.minute
+
+
+    @endpoints.method(SESSION_SEARCH_REQUEST, SessionForms,
+            path='searchSessions/{websafeConferenceKey}',
+            http_method='POST', name='searchSessions')
+    @instrumented
+    def searchSessions(self, request):
+        """Return sessions in a conference by date, start time window,
+        type and duration!"""
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        if c_key.kind() != 'Conference':
+            raise endpoints.NotFoundException(
+                'No conference exists with key: %s' % request.websafeConferenceKey)
+
+        if request.date:
+            try:
+                datetime.strptime(request.date, '%Y-%m-%d')
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    'date must be given as YYYY-MM-DD')
+        after = before = None
+        if request.startAfter:
+            after = self._minuteOfDay(request.startAfter, 'startAfter')
+        if request.startBefore:
+            before = self._minuteOfDay(request.startBefore, 'startBefore')
+        include = set(str(t) for t in request.includeTypes)
+        exclude = set(str(t) for t in request.excludeTypes)
+        timed = request.date or after is not None or before is not None
+
+        # skip whole buckets outside the date and hour window first
+        index = (ndb.Key(SessionIndex, c_key.urlsafe()).get() or
+            self._storeSessionIndex(c_key))
+        ids = []
+        for bucket, rows in (index.buckets or {}).iteritems():
+            if not bucket:
+                if timed:
+                    continue
+            else:
+                date, hour = bucket.split(' ')
+                hour = int(hour) * 60
+                if ((request.date and date != request.date) or
+                        (after is not None and hour + 59 < after) or
+                        (before is not None and hour >= before)):
+                    continue
+            for s_id, minute, duration, typeOfSession in rows:
+                if ((after is not None and minute < after) or
+                        (before is not None and minute >= before) or
+                        (include and typeOfSession not in include) or
+                        typeOfSession in exclude or
+                        (request.maxDuration is not None and
+                            (duration or 0) > request.maxDuration)):
+                    continue
+                ids.append(s_id)
+
+        sessions = ndb.get_multi([ndb.Key(Session, s_id, parent=c_key)
+            for s_id in ids])
+        sessions = sorted((s for s in sessions if s),
+            key=lambda s: s.dateTime or datetime.max)
+        return SessionForms(items=[self._copySessionToForm(session)
+            for session in sessions])
+
+
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _queueIndexing(keys):
+        """Queue a search index update of Conferences/Sessions; inside a
+        transaction the task is only queued if the write commits."""
+        taskqueue.add(params={'websafeKey': [key.urlsafe() for key in keys]},
+            url='/tasks/index_documents', transactional=ndb.in_transaction())
+
+
+    @staticmethod
+    def _reindex(kind, cursor=None, batch=100):
+        """Queue a search index update of a batch of kind, chaining the
+        next batch; used to index data written before search existed."""
+        keys, nextCursor, more = ndb.Query(kind=kind).fetch_page(batch,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None,
+            keys_only=True)
+        if keys:
+            ConferenceApi._queueIndexing(keys)
+        if more and nextCursor:
+            taskqueue.add(params={'kind': kind, 'cursor': nextCursor.urlsafe()},
+                url='/tasks/reindex')
+
+
+    @endpoints.method(SEARCH_REQUEST, SearchResultForms,
+            path='search', http_method='GET', name='search')
+    @instrumented
+    def search(self, request):
+        """Return conferences and sessions matching free text, best first!"""
+        kinds = SEARCH_KINDS.get(request.kind or 'ALL')
+        if not kinds:
+            raise endpoints.BadRequestException(
+                'kind must be one of: %s' % ', '.join(sorted(SEARCH_KINDS)))
+        pageSize = request.pageSize or QUERY_PAGE_SIZE
+        if not 0 < pageSize <= QUERY_MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                'pageSize must be between 1 and %d' % QUERY_MAX_PAGE_SIZE)
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            raise endpoints.BadRequestException('Invalid pageToken')
+        if offset < 0:
+            raise endpoints.BadRequestException('Invalid pageToken')
+
+        hits = textindex.search(request.q or '', kinds, SEARCH_MAX_RESULTS)
+        page = hits[offset:offset + pageSize]
+        entities = ndb.get_multi([ndb.Key(urlsafe=wsk) for _, wsk in page])
+
+        # start every conference rendering before waiting on any
+        organisers = {}
+        rendered = []
+        for (score, _), entity in zip(page, entities):
+            if entity is None:
+                continue    # deleted since it was indexed
+            if entity.key.kind() == 'Conference':
+                rendered.append((score,
+                    self._conferenceFormAsync(entity, organisers), None))
+            else:
+                rendered.append((score, None, self._copySessionToForm(entity)))
+
+        nextPageToken = None
+        if offset + pageSize < len(hits):
+            nextPageToken = str(offset + pageSize)
+        return SearchResultForms(items=[SearchResultForm(score=score,
+                conference=cf.get_result() if cf else None, session=sf)
+            for score, cf, sf in rendered], nextPageToken=nextPageToken)
+
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, displayName=None):
         """Copy relevant fields from Conference to ConferenceForm"""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        cf = copyConferenceToForm(conf)
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+            cf.organizerDisplayName = displayName
         return cf
 
 
+    def _copyConferencesToForms(self, confs):
+        """Copy Conferences to ConferenceForms from the entities alone;
+        organisers are only looked up for conferences stored before the
+        display name was kept on the Conference."""
+        return self._conferenceFormsAsync(confs).get_result()
+
+
+    @ndb.tasklet
+    def _conferenceFormsAsync(self, confs):
+        """Tasklet rendering Conferences (or their keys) to ConferenceForms.
+
+        Every conference is fetched and rendered by its own tasklet, so an
+        organiser lookup starts as soon as its conference arrives instead
+        of after the whole batch; missing conferences are dropped.
+        """
+        organisers = {}
+        forms = yield [self._conferenceFormAsync(conf, organisers)
+            for conf in confs]
+        raise ndb.Return([cf for cf in forms if cf])
+
+
+    @ndb.tasklet
+    def _conferenceFormAsync(self, conf, organisers):
+        """Tasklet rendering one Conference (or its key) to a ConferenceForm.
+
+        organisers maps Profile keys to the futures already started for
+        them in this request, so each organiser is fetched at most once.
+        """
+        if isinstance(conf, ndb.Key):
+            conf = yield conf.get_async(use_cache=True)
+            if not conf:
+                raise ndb.Return(None)
+        displayName = None
+        if conf.organizerDisplayName is None:
+            p_key = ndb.Key(Profile, conf.organizerUserId)
+            if p_key not in organisers:
+                organisers[p_key] = p_key.get_async(use_cache=True)
+            prof = yield organisers[p_key]
+            displayName = getattr(prof, 'displayName', None)
+        raise ndb.Return(self._copyConferenceToForm(conf, displayName))
+
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
@@ -292,7 +938,8 @@ class ConferenceApi(remote.Service):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
-        del data['organizerDisplayName']
+        # etag and notModified only ever go out in responses
+        del data['etag'], data['notModified']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -319,19 +966,35 @@ class ConferenceApi(remote.Service):
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        prof = p_key.get()
+        data['organizerDisplayName'] = request.organizerDisplayName = (
+            prof.displayName if prof else user.nickname())
+
+        # spread the seat inventory over counter shards if configured
+        entities = []
+        if SEAT_SHARDS > 0 and data["maxAttendees"] > 0:
+            data['seatShards'] = SEAT_SHARDS
+            entities = self._newSeatShards(c_key, data["seatsAvailable"])
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
-        # Conference(**data).put()
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        conf = Conference(**data)
+        entities.append(conf)
+
+        # the shards are root entities, so this spans at most
+        # SEAT_SHARDS + 1 entity groups; a conference never exists
+        # without its seats
+        @ndb.transactional(xg=True)
+        def create():
+            ndb.put_multi(entities)
+            self._trackNearlySoldOut(conf, None)
+            self._queueIndexing([c_key])
+        create()
+        self._queueConfirmationEmail(user.email(), repr(request))
         return request
 
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -355,8 +1018,18 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        oldMaxAttendees = conf.maxAttendees
+        oldSeats = conf.seatsAvailable
+        oldName = conf.name
         for field in request.all_fields():
             data = getattr(request, field.name)
+            # seats of a sharded conference are owned by its shards
+            if conf.seatShards and field.name == 'seatsAvailable':
+                continue
+            # the organiser's name follows their Profile; etag and
+            # notModified only ever go out in responses
+            if field.name in ('organizerDisplayName', 'etag', 'notModified'):
+                continue
             # only copy fields where we get data
             if data not in (None, []):
                 # special handling for dates (convert string to Date)
@@ -366,13 +1039,26 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+        if conf.seatShards and conf.maxAttendees != oldMaxAttendees:
+            conf.seatsAvailable = self._resizeSeatShards(
+                conf, (conf.maxAttendees or 0) - (oldMaxAttendees or 0))
+        # organiser Profile shares the entity group; backfill its name
+        if conf.organizerDisplayName is None:
+            prof = ndb.Key(Profile, user_id).get()
+            conf.organizerDisplayName = getattr(prof, 'displayName')
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        self._trackNearlySoldOut(conf, oldSeats, oldName)
+        self._queueIndexing([conf.key])
+        if conf.seatsAvailable > oldSeats:
+            self._queuePromotion(conf.key)
+        ndb.get_context().call_on_commit(
+            lambda: self._invalidateConference(request.websafeConferenceKey))
+        return self._copyConferenceToForm(conf)
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @instrumented
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -381,29 +1067,55 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @instrumented
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
         return self._updateConferenceObject(request)
 
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    @endpoints.method(CONF_ETAG_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
+    @instrumented
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
+        # serve the rendered form while it matches the conference version
+        wsck = request.websafeConferenceKey
+        cacheKey = MEMCACHE_CONFERENCE_KEY % wsck
+        version, cached = caching.getVersioned(cacheKey,
+            MEMCACHE_CONFERENCE_VERSION_KEY % wsck, CONFERENCE_LRU)
+        etag = str(version)
+        if cached:
+            # the client's copy is current; skip decoding
+            if request.ifNoneMatch == etag:
+                return ConferenceForm(etag=etag, notModified=True)
+            cf = protojson.decode_message(ConferenceForm, cached)
+            cf.etag = etag
+            return cf
+
         # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
+        cf = self._conferenceFormAsync(ndb.Key(urlsafe=wsck), {}).get_result()
+        if not cf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
-        # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
-        
+                'No conference found with key: %s' % wsck)
+        # cache and return ConferenceForm
+        caching.setVersioned(cacheKey, version,
+            protojson.encode_message(cf), CONFERENCE_LRU)
+        cf.etag = etag
+        return cf
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+
+    @staticmethod
+    def _invalidateConference(wsck):
+        """Make cached renderings of a conference unreachable; call only
+        once the write has committed."""
+        caching.bumpVersion(MEMCACHE_CONFERENCE_VERSION_KEY % wsck)
+
+
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @instrumented
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
@@ -412,38 +1124,37 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         user_id =  getUserId(user)
 
-        # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, 
-            getattr(prof, 'displayName')) for conf in confs])
+        # the summary view reads only its properties from the index
+        if self._summaryView(request.view):
+            confs = Conference.query(ancestor=ndb.Key(Profile, user_id)).fetch(
+                projection=SUMMARY_PROPERTIES)
+            return ConferenceForms(summaries=[copyConferenceToSummaryForm(conf)
+                for conf in confs])
 
+        # create ancestor query for all key matches for this user, rendering
+        # each ConferenceForm as its Conference comes back
+        organisers = {}
+        forms = Conference.query(ancestor=ndb.Key(Profile, user_id)).map(
+            lambda conf: self._conferenceFormAsync(conf, organisers))
+        return ConferenceForms(items=forms)
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+    def _summaryView(self, view):
+        """Return True for the summary view, False for the full one."""
+        if view not in (None, 'full', 'summary'):
+            raise endpoints.BadRequestException(
+                'view must be either full or summary.')
+        return view == 'summary'
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+
+    def _getQuery(self, request):
+        """Return the QueryPlan for the submitted filters."""
+        return planner.plan(self._formatFilters(request.filters))
 
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
@@ -451,62 +1162,142 @@ class ConferenceApi(remote.Service):
             try:
                 filtr["field"] = FIELDS[filtr["field"]]
                 filtr["operator"] = OPERATORS[filtr["operator"]]
-            except KeyError:
-                raise endpoints.BadRequestException("Filter contains invalid field or operator.")
-
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException('Inequality filter is allowed on only one field.')
-                else:
-                    inequality_field = filtr["field"]
+                if filtr["field"] in ["month", "maxAttendees"]:
+                    filtr["value"] = int(filtr["value"])
+            except (KeyError, TypeError, ValueError):
+                raise endpoints.BadRequestException("Filter contains invalid field, operator or value.")
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @instrumented
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        """Query for conferences, one page at a time."""
+        plan = self._getQuery(request)
+        summary = self._summaryView(request.view)
+        if request.explain:
+            return ConferenceForms(plan=plan.explain())
+
+        pageSize = request.pageSize or QUERY_PAGE_SIZE
+        if not 0 < pageSize <= QUERY_MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                'pageSize must be between 1 and %d.' % QUERY_MAX_PAGE_SIZE)
+        try:
+            cursor = Cursor(urlsafe=request.cursor) if request.cursor else None
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException('Invalid cursor.')
+
+        # stream the datastore part of the plan once, filtering the rest in
+        # memory; stop at a full page or after QUERY_MAX_SCAN entities
+        forms, nextCursor = self._queryPageAsync(plan, cursor, pageSize,
+            summary).get_result()
+        if summary:
+            return ConferenceForms(summaries=forms, nextCursor=nextCursor)
+        return ConferenceForms(items=forms, nextCursor=nextCursor)
+
+
+    @ndb.tasklet
+    def _queryPageAsync(self, plan, cursor, pageSize, summary=False):
+        """Tasklet returning (forms, nextCursor) for one page of a plan;
+        each matching conference starts rendering as soon as it arrives.
+
+        Summary pages come from a projection query when an index serves
+        one, so their cursors only continue pages of the same view.
+        """
+        projection, known = None, None
+        if summary:
+            projection, known = (plan.projection(SUMMARY_PROPERTIES) or
+                (None, None))
+        results = plan.query().iter(start_cursor=cursor, produce_cursors=True,
+            batch_size=min(pageSize * 2, QUERY_MAX_SCAN), projection=projection)
+        organisers = {}
+        forms = []
+        nextCursor = None
+        scanned = 0
+        while (yield results.has_next_async()):
+            conf = results.next()
+            scanned += 1
+            if plan.matches(conf):
+                forms.append(copyConferenceToSummaryForm(conf, known) if summary
+                    else self._conferenceFormAsync(conf, organisers))
+            if len(forms) == pageSize or scanned == QUERY_MAX_SCAN:
+                if (yield results.has_next_async()):
+                    nextCursor = results.cursor_after().urlsafe()
+                break
+        if not summary:
+            forms = yield forms
+        raise ndb.Return(forms, nextCursor)
+
+
+# - - - Confirmation emails - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _queueConfirmationEmail(email, conferenceInfo):
+        """Queue a conference creation confirmation for the email worker."""
+        taskqueue.Queue(CONFIRMATION_QUEUE).add(taskqueue.Task(
+            payload=json.dumps({'email': email,
+                'conferenceInfo': conferenceInfo}),
+            method='PULL'))
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
 
-        # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, 
-                    names[conf.organizerUserId]) for conf in conferences])
+    @staticmethod
+    def _sendConfirmationEmails(budget=CONFIRMATION_TIME_BUDGET):
+        """Lease queued confirmations in batches, send one email per
+        recipient and batch, and delete the sent tasks in bulk; used by
+        the confirmation email cron job. Returns the number sent."""
+        queue = taskqueue.Queue(CONFIRMATION_QUEUE)
+        sender = 'noreply@%s.appspotmail.com' % (
+            app_identity.get_application_id())
+        deadline = time.time() + budget
+        sent = 0
+        while time.time() < deadline:
+            tasks = queue.lease_tasks(CONFIRMATION_LEASE,
+                taskqueue.MAX_TASKS_PER_LEASE)
+            if not tasks:
+                break
+            byEmail = {}
+            done = []
+            for task in tasks:
+                try:
+                    data = json.loads(task.payload)
+                    email, info = data['email'], data['conferenceInfo']
+                except (ValueError, TypeError, KeyError):
+                    # would fail every lease; drop it instead of retrying
+                    logging.error('Dropping malformed confirmation task %s: %r',
+                        task.name, task.payload)
+                    done.append(task)
+                    continue
+                byEmail.setdefault(email, []).append((task, info))
+
+            for email, queued in byEmail.iteritems():
+                infos = [conferenceInfo for _, conferenceInfo in queued]
+                try:
+                    mail.send_mail(sender, email,
+                        'You created a new Conference!' if len(infos) == 1
+                            else 'You created %d new Conferences!' % len(infos),
+                        'Hi, you have created the following '
+                        'conference%s:\r\n\r\n%s' % (
+                            's' if len(infos) > 1 else '',
+                            '\r\n\r\n'.join(infos)))
+                except mail.Error:
+                    # leave them leased; they come back when it runs out
+                    logging.exception('Confirmation email to %s failed', email)
+                    continue
+                done.extend(task for task, _ in queued)
+                sent += 1
+            if done:
+                queue.delete_tasks(done)
+        return sent
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, 
-                    getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return copyProfileToForm(prof)
 
 
     def _getProfileFromUser(self):
@@ -540,19 +1331,77 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            oldDisplayName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
                     if val:
                         setattr(prof, field, str(val))
             prof.put()
+            # copy a new display name onto the user's conferences
+            if prof.displayName != oldDisplayName:
+                taskqueue.add(params={'userId': prof.key.id()},
+                    url='/tasks/update_organizer_name')
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
 
+    @staticmethod
+    def _updateOrganizerName(user_id, cursor=None, batch=100):
+        """Copy a Profile's displayName onto its conferences, a batch per
+        task; used by the update_organizer_name task."""
+        p_key = ndb.Key(Profile, user_id)
+        c_keys, nextCursor, more = Conference.query(ancestor=p_key).fetch_page(
+            batch, start_cursor=Cursor(urlsafe=cursor) if cursor else None,
+            keys_only=True)
+
+        # the conferences share the Profile's entity group, so rewrite
+        # the batch in one transaction without clobbering concurrent edits
+        @ndb.transactional()
+        def update():
+            name = p_key.get().displayName
+            stale = [conf for conf in ndb.get_multi(c_keys)
+                if conf and conf.organizerDisplayName != name]
+            for conf in stale:
+                conf.organizerDisplayName = name
+            ndb.put_multi(stale)
+            return stale
+        for conf in update():
+            ConferenceApi._invalidateConference(conf.key.urlsafe())
+
+        if more and nextCursor:
+            taskqueue.add(params={'userId': user_id,
+                'cursor': nextCursor.urlsafe()},
+                url='/tasks/update_organizer_name')
+
+
+    @staticmethod
+    def _migrateProfiles(cursor=None, batch=100):
+        """Move legacy urlsafe key strings of a batch of Profiles to key
+        lists, chaining the next batch; used by the migrate_profiles task."""
+        profiles, nextCursor, more = Profile.query().fetch_page(batch,
+            start_cursor=Cursor(urlsafe=cursor) if cursor else None)
+
+        @ndb.transactional()
+        def migrate(p_key):
+            # the get hook migrates; only the write is left to do
+            prof = p_key.get()
+            prof.put()
+
+        for prof in profiles:
+            # query results skip the get hook, so legacy lists show here
+            if prof.conferenceKeysToAttend or prof.sessionWishlist:
+                migrate(prof.key)
+
+        if more and nextCursor:
+            taskqueue.add(params={'cursor': nextCursor.urlsafe()},
+                url='/tasks/migrate_profiles')
+
+
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
+    @instrumented
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
@@ -560,6 +1409,7 @@ class ConferenceApi(remote.Service):
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @instrumented
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
@@ -567,45 +1417,158 @@ class ConferenceApi(remote.Service):
 
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -             
     @staticmethod
-    def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+    def _isNearlySoldOut(seats):
+        """Return True if a conference with seats left gets announced."""
+        return seats is not None and 0 < seats <= NEARLY_SOLD_OUT_SEATS
+
+
+    @staticmethod
+    def _trackNearlySoldOut(conf, oldSeats, oldName=None):
+        """Queue an announcement update if a seat change moved conf across
+        the nearly sold out threshold, or a listed conf was renamed; inside
+        a transaction the task is only queued if the change commits."""
+        listed = ConferenceApi._isNearlySoldOut(conf.seatsAvailable)
+        renamed = oldName is not None and oldName != conf.name
+        if (ConferenceApi._isNearlySoldOut(oldSeats) != listed or
+                (listed and renamed)):
+            taskqueue.add(params={'websafeConferenceKey': conf.key.urlsafe()},
+                url='/tasks/update_nearly_sold_out',
+                transactional=ndb.in_transaction())
 
-        if confs:
+
+    @staticmethod
+    def _renderAnnouncement(names):
+        """Format the announcement for names & assign it to memcache,
+        bumping its version if it changed; returns (version, text)."""
+        if names:
             # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+            # format the announcement
+            announcement = ANNOUNCEMENT_TPL % ', '.join(names)
         else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
+            # If there are no sold out conferences, announce nothing
             announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        version = caching.setVersionedIfChanged(MEMCACHE_ANNOUNCEMENTS_KEY,
+            MEMCACHE_ANNOUNCEMENTS_VERSION_KEY, announcement)
+        return version, announcement
+
+
+    @staticmethod
+    def _updateNearlySoldOut(wsck):
+        """Add/remove/rename one conference in the nearly sold out set,
+        and re-render the announcement only if the set changed; used by
+        the update_nearly_sold_out task."""
+        c_key = ndb.Key(urlsafe=wsck)
+        if not NEARLY_SOLD_OUT_KEY.get():
+            ConferenceApi._seedNearlySoldOut()
+
+        # read the seats in the transaction so out of order tasks for the
+        # same conference cannot undo each other
+        @ndb.transactional(xg=True)
+        def update():
+            conf = c_key.get()
+            listed = conf is not None and ConferenceApi._isNearlySoldOut(
+                conf.seatsAvailable)
+            entry = NEARLY_SOLD_OUT_KEY.get()
+            present = c_key in entry.conferenceKeys
+            if present and listed:
+                # still listed; only a rename changes the entry
+                i = entry.conferenceKeys.index(c_key)
+                if entry.conferenceNames[i] == conf.name:
+                    return None
+                entry.conferenceNames[i] = conf.name
+            elif present == listed:
+                return None
+            elif listed:
+                entry.conferenceKeys.append(c_key)
+                entry.conferenceNames.append(conf.name)
+            else:
+                i = entry.conferenceKeys.index(c_key)
+                del entry.conferenceKeys[i]
+                del entry.conferenceNames[i]
+            entry.put()
+            return entry
+
+        entry = update()
+        if entry:
+            ConferenceApi._renderAnnouncement(entry.conferenceNames)
+
+
+    @staticmethod
+    def _scanNearlySoldOut():
+        """Return the keys of the conferences a (possibly stale) index scan
+        finds nearly sold out."""
+        return Conference.query(ndb.AND(
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+            Conference.seatsAvailable > 0)
+        ).fetch(keys_only=True)
+
+
+    @staticmethod
+    def _seedNearlySoldOut():
+        """Build the nearly sold out set from a full scan, re-reading each
+        conference found by key, and store it unless it got stored in the
+        meantime; returns the stored NearlySoldOut."""
+        confs = [conf for conf in ndb.get_multi(
+                ConferenceApi._scanNearlySoldOut())
+            if conf and ConferenceApi._isNearlySoldOut(conf.seatsAvailable)]
+
+        @ndb.transactional()
+        def store():
+            entry = NEARLY_SOLD_OUT_KEY.get()
+            if not entry:
+                entry = NearlySoldOut(key=NEARLY_SOLD_OUT_KEY,
+                    conferenceKeys=[conf.key for conf in confs],
+                    conferenceNames=[conf.name for conf in confs])
+                entry.put()
+            return entry
+        return store()
 
-        return announcement
 
+    @staticmethod
+    def _cacheAnnouncement():
+        """Reconcile the nearly sold out set with a full scan & assign the
+        announcement to memcache; used by the reconciling cron job.
+
+        Conferences the scan and the set disagree about get an
+        update_nearly_sold_out task, which re-reads their seats in a
+        transaction, so a stale scan can't undo an incremental update.
+        """
+        entry = NEARLY_SOLD_OUT_KEY.get()
+        if not entry:
+            entry = ConferenceApi._seedNearlySoldOut()
+        else:
+            suspects = set(ConferenceApi._scanNearlySoldOut()).symmetric_difference(
+                entry.conferenceKeys)
+            tasks = [taskqueue.Task(params={'websafeConferenceKey': c_key.urlsafe()},
+                url='/tasks/update_nearly_sold_out') for c_key in suspects]
+            queue = taskqueue.Queue()
+            for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+                queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+        return ConferenceApi._renderAnnouncement(entry.conferenceNames)[1]
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+
+    @endpoints.method(ETAG_REQUEST, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
+    @instrumented
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        version, announcement = caching.getVersioned(
+            MEMCACHE_ANNOUNCEMENTS_KEY, MEMCACHE_ANNOUNCEMENTS_VERSION_KEY)
+        if announcement is None:
+            # memcache lost it; render from the maintained set
+            entry = NEARLY_SOLD_OUT_KEY.get()
+            version, announcement = self._renderAnnouncement(
+                entry.conferenceNames if entry else [])
+        elif request.ifNoneMatch == str(version):
+            return StringMessage(data="", etag=request.ifNoneMatch,
+                notModified=True)
+        return StringMessage(data=announcement, etag=str(version))
 
         
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register/unregister a user for a selected conference"""
-        retval = None
-        prof = self._getProfileFromUser() # get user Profile
-
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
@@ -613,10 +1576,28 @@ class ConferenceApi(remote.Service):
         if not conf:
             raise endpoints.NotFoundException('No conference found with key: %s' % wsck)
 
+        if conf.seatShards:
+            retval = self._shardedRegistration(conf, reg)
+        else:
+            retval = self._entityRegistration(conf.key, reg)
+        if retval:
+            self._invalidateConference(wsck)
+        return BooleanMessage(data=retval)
+
+
+    @ndb.transactional(xg=True)
+    def _entityRegistration(self, c_key, reg, p_key=None):
+        """Register/unregister against the seats kept on the Conference"""
+        retval = None
+        # user Profile (or the given one, for waitlist promotion)
+        prof = p_key.get() if p_key else self._getProfileFromUser()
+        conf = c_key.get()
+        oldSeats = conf.seatsAvailable
+
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if prof.attends(c_key):
                 raise ConflictException('You have already registered for this conference')
 
             # check if seats avail
@@ -625,18 +1606,18 @@ class ConferenceApi(remote.Service):
                     "There are no seats available.")
 
             # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
+            prof.addConference(c_key)
             conf.seatsAvailable -= 1
             retval = True
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if prof.removeConference(c_key):
 
                 # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
                 conf.seatsAvailable += 1
+                self._queuePromotion(c_key)
                 retval = True
             else:
                 retval = False
@@ -644,35 +1625,83 @@ class ConferenceApi(remote.Service):
         # write things back to the datastore & return
         prof.put()
         conf.put()
-        return BooleanMessage(data=retval)
+        self._trackNearlySoldOut(conf, oldSeats)
+        return retval
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    def _shardedRegistration(self, conf, reg, p_key=None):
+        """Register/unregister against a randomly picked seat shard.
+
+        Only the Profile and one SeatShard take part in the transaction, so
+        concurrent registrations for the same conference rarely collide.
+        """
+        shards = [s for s in ndb.get_multi(self._seatShardKeys(conf)) if s]
+        if reg:
+            shards = [s for s in shards if s.seatsAvailable > 0]
+        random.shuffle(shards)
+
+        # a shard can drain between the read above and the transaction;
+        # move on to the next one until a seat is found
+        for shard in shards:
+            retval = self._shardRegistration(conf.key, shard.key, reg, p_key)
+            if retval is not None:
+                if retval:
+                    self._scheduleSeatSync(conf.key)
+                return retval
+        if not reg:
+            return False
+        raise ConflictException("There are no seats available.")
+
+
+    @ndb.transactional(xg=True)
+    def _shardRegistration(self, c_key, shard_key, reg, p_key=None):
+        """Take/return one seat from a shard; None if the shard is empty"""
+        # user Profile (or the given one, for waitlist promotion)
+        prof = p_key.get() if p_key else self._getProfileFromUser()
+        shard = shard_key.get()
+
+        if reg:
+            if prof.attends(c_key):
+                raise ConflictException('You have already registered for this conference')
+            if shard.seatsAvailable <= 0:
+                return None
+            prof.addConference(c_key)
+            shard.seatsAvailable -= 1
+        else:
+            if not prof.removeConference(c_key):
+                return False
+            shard.seatsAvailable += 1
+            self._queuePromotion(c_key)
+
+        ndb.put_multi([prof, shard])
+        return True
+
+
+    @endpoints.method(CONF_LIST_REQUEST, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @instrumented
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # conferences are fetched by key, which has no projection; the
+        # summary view only saves the organiser lookups and response size
+        if self._summaryView(request.view):
+            confs = ndb.get_multi(prof.conferencesToAttend)
+            return ConferenceForms(summaries=[copyConferenceToSummaryForm(conf)
+                for conf in confs if conf])
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, 
-            names[conf.organizerUserId]) for conf in conferences])
+        return ConferenceForms(items=self._copyConferencesToForms(
+            prof.conferencesToAttend))
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @instrumented
+    @ratelimited(lambda request: request.websafeConferenceKey)
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
@@ -681,11 +1710,169 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
+    @instrumented
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
         
 
+# - - - Waitlist - - - - - - - - - - - - - - - - - - - - - -
+    @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
+            path='conference/{websafeConferenceKey}/waitlist',
+            http_method='POST', name='joinWaitlist')
+    @instrumented
+    def joinWaitlist(self, request):
+        """Join the waitlist of a sold out conference; False if already on it."""
+        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException('No conference found with key: %s' % wsck)
+        prof = self._getProfileFromUser() # get user Profile
+        if prof.attends(conf.key):
+            raise ConflictException('You have already registered for this conference')
+        if self._liveSeatsAvailable(conf) > 0:
+            raise ConflictException(
+                'There are seats available; register for the conference instead.')
+        return BooleanMessage(data=self._joinWaitlist(conf.key, prof.key.id()))
+
+
+    @ndb.transactional()
+    def _joinWaitlist(self, c_key, user_id):
+        """Add a user at the tail of a waitlist; False if already on it"""
+        w_key = ndb.Key(WaitlistEntry, '%s:%s' % (c_key.urlsafe(), user_id))
+        if w_key.get():
+            return False
+        WaitlistEntry(key=w_key, conference=c_key, userId=user_id).put()
+        return True
+
+
+    @staticmethod
+    def _queuePromotion(c_key):
+        """Queue a waitlist promotion for a freed seat; inside a
+        transaction the task is only queued if the seat is freed."""
+        taskqueue.add(params={'websafeConferenceKey': c_key.urlsafe()},
+            url='/tasks/promote_waitlist', transactional=ndb.in_transaction())
+
+
+    @staticmethod
+    def _promoteWaitlist(wsck):
+        """Register waitlisted users, oldest first, while seats are free;
+        used by the promote_waitlist task."""
+        c_key = ndb.Key(urlsafe=wsck)
+        api = ConferenceApi()
+        promoted = False
+        waiting = WaitlistEntry.query(WaitlistEntry.conference == c_key).order(
+            WaitlistEntry.joined)
+        for w_key in waiting.iter(keys_only=True):
+            try:
+                promoted = api._promote(c_key, w_key) or promoted
+            except ConflictException:
+                break   # no seats left; the rest keep their place
+        if promoted:
+            ConferenceApi._invalidateConference(wsck)
+
+
+    @ndb.transactional(xg=True)
+    def _promote(self, c_key, w_key):
+        """Move one waitlisted user into a seat and off the waitlist in one
+        transaction; False if there was nothing to do for them."""
+        entry = w_key.get()
+        if not entry:
+            return False    # promoted by an earlier run
+        w_key.delete()
+        p_key = ndb.Key(Profile, entry.userId)
+        prof = p_key.get()
+        if not prof or prof.attends(c_key):
+            return False    # registered some other way meanwhile
+        conf = c_key.get()
+        if conf.seatShards:
+            return self._shardedRegistration(conf, True, p_key)
+        return self._entityRegistration(c_key, True, p_key)
+
+
+# - - - Seat shards - - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _seatShardKeys(conf):
+        """Return the SeatShard keys of a sharded conference."""
+        wsck = conf.key.urlsafe()
+        return [ndb.Key(SeatShard, '%s:%d' % (wsck, i))
+            for i in range(conf.seatShards)]
+
+
+    @staticmethod
+    def _liveSeatsAvailable(conf):
+        """Return conf's seats left, summed from its shards if sharded
+        rather than read from the lagging Conference.seatsAvailable."""
+        if not conf.seatShards:
+            return conf.seatsAvailable
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(conf))
+        return sum(s.seatsAvailable for s in shards if s)
+
+
+    @staticmethod
+    def _newSeatShards(c_key, seats):
+        """Split a new conference's seats evenly over SEAT_SHARDS shards."""
+        wsck = c_key.urlsafe()
+        share, extra = divmod(seats, SEAT_SHARDS)
+        return [SeatShard(id='%s:%d' % (wsck, i),
+            seatsAvailable=share + (1 if i < extra else 0))
+            for i in range(SEAT_SHARDS)]
+
+
+    def _resizeSeatShards(self, conf, delta):
+        """Add/remove seats across the shards; return the new seat total.
+
+        Runs inside the caller's cross-group transaction.
+        """
+        shards = [s for s in ndb.get_multi(self._seatShardKeys(conf)) if s]
+        if delta > 0:
+            random.choice(shards).seatsAvailable += delta
+        else:
+            # drain the fullest shards first, never below zero
+            for shard in sorted(shards, key=lambda s: -s.seatsAvailable):
+                taken = min(shard.seatsAvailable, -delta)
+                shard.seatsAvailable -= taken
+                delta += taken
+        ndb.put_multi(shards)
+        return sum(s.seatsAvailable for s in shards)
+
+
+    @staticmethod
+    def _scheduleSeatSync(c_key):
+        """Queue at most one seatsAvailable re-sync per SEAT_SYNC_INTERVAL."""
+        window = int(time.time() / SEAT_SYNC_INTERVAL)
+        try:
+            taskqueue.add(name='seats-%s-%d' % (c_key.urlsafe(), window),
+                params={'websafeConferenceKey': c_key.urlsafe()},
+                url='/tasks/sync_seats',
+                countdown=SEAT_SYNC_INTERVAL)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+
+    @staticmethod
+    def _syncSeatsAvailable(wsck):
+        """Copy the summed shard seats onto Conference.seatsAvailable;
+        used by the sync_seats task.
+        """
+        c_key = ndb.Key(urlsafe=wsck)
+        conf = c_key.get()
+        if not conf or not conf.seatShards:
+            return
+        seats = ConferenceApi._liveSeatsAvailable(conf)
+
+        @ndb.transactional()
+        def update():
+            conf = c_key.get()
+            if conf.seatsAvailable != seats:
+                oldSeats, conf.seatsAvailable = conf.seatsAvailable, seats
+                conf.put()
+                ConferenceApi._trackNearlySoldOut(conf, oldSeats)
+                ndb.get_context().call_on_commit(
+                    lambda: ConferenceApi._invalidateConference(wsck))
+        update()
+
+
 # - - - Wishlist - - - - - - - - - - - - - - - - - - - - - - -
     @ndb.transactional(xg=True)
     def _manageWishlist(self, request, reg=True):
@@ -694,34 +1881,33 @@ class ConferenceApi(remote.Service):
         prof = self._getProfileFromUser() # get user Profile
         # check if session exists given the SessionfKey
         sk = request.sessionKey
-        sess = ndb.Key(urlsafe=sk).get()
+        s_key = ndb.Key(urlsafe=sk)
+        sess = s_key.get()
         if not sess:
             raise endpoints.NotFoundException("No session could be found with key: %s" % sk)
 
         if reg:
             # check if the session is already in the users wishlist
-            if sk in prof.sessionWishlist:
+            if not prof.addToWishlist(s_key):
                 raise ConflictException("You have already registered for this session!")
-
-            prof.sessionWishlist.append(sk)
             retval = True
 
         else:
-
-            if sk in prof.sessionWishlist:
-                prof.sessionWishlist.remove(sk)
-                retval = True
-            else:
-                retval = False
+            retval = prof.removeFromWishlist(s_key)
 
         # write things back to the datastore & return
         prof.put()
+        user_id = prof.key.id()
+        ndb.get_context().call_on_commit(lambda: caching.bumpVersion(
+            MEMCACHE_SCHEDULE_VERSION_KEY % user_id))
         return BooleanMessage(data=retval)
 
 
     @endpoints.method(WISHLIST_REQUEST, BooleanMessage,
             path='session/{sessionKey}',
             http_method='POST', name='addSessionToWishlist')
+    @instrumented
+    @ratelimited(_wishlistConference)
     def addToWishlist(self, request):
         """Add session to wishlist!"""
         return self._manageWishlist(request)
@@ -730,6 +1916,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(WISHLIST_REQUEST, BooleanMessage,
             path='session/{sessionKey}',
             http_method='DELETE', name='deleteSessionFromWishlist')
+    @instrumented
     def deleteFromWishlist(self, request):
         """Delete session from wishlist!"""
         return self._manageWishlist(request, reg=False)
@@ -738,13 +1925,72 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, SessionForms,
             path='wishlist',
             http_method='POST', name='getSessionsInWishlist')
+    @instrumented
     def getSessionsInWishlist(self, request):
         """Return the wishlist for user!"""
         prof = self._getProfileFromUser() # get user Profile
-        session_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.sessionWishlist]
-        sessions = ndb.get_multi(session_keys)
+        sessions = ndb.get_multi(prof.wishlistSessions)
         return SessionForms (items=[self._copySessionToForm(session) 
-            for session in sessions])
+            for session in sessions if session])
+
+
+    @endpoints.method(message_types.VoidMessage, ScheduleForms,
+            path='wishlist/schedule',
+            http_method='GET', name='getWishlistSchedule')
+    @instrumented
+    def getWishlistSchedule(self, request):
+        """Return the wishlist as an itinerary with clashes flagged!"""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        # serve the itinerary built for the current wishlist version
+        cacheKey = MEMCACHE_SCHEDULE_KEY % user_id
+        version, cached = caching.getVersioned(cacheKey,
+            MEMCACHE_SCHEDULE_VERSION_KEY % user_id)
+        if cached is not None:
+            return protojson.decode_message(ScheduleForms, cached)
+
+        prof = self._getProfileFromUser() # get user Profile
+        sessions = [s for s in ndb.get_multi(prof.wishlistSessions) if s]
+        schedule = self._schedule(sessions)
+        caching.setVersioned(cacheKey, version,
+            protojson.encode_message(schedule))
+        return schedule
+
+
+    def _schedule(self, sessions):
+        """Sort sessions into an itinerary, flagging every pair whose times
+        overlap with one sort-and-sweep pass."""
+        timed = []
+        unscheduled = []
+        for session in sessions:
+            if session.dateTime:
+                end = session.dateTime + timedelta(minutes=
+                    session.duration or SESSION_DEFAULTS['duration'])
+                timed.append((session.dateTime, end, session))
+            else:
+                unscheduled.append(self._copySessionToForm(session))
+        timed.sort(key=lambda t: t[0])
+
+        # active holds (end, index) of the sessions still running at the
+        # current start; whatever is left in it after dropping the ended
+        # ones overlaps the session starting now
+        items = []
+        active = []
+        for i, (start, end, session) in enumerate(timed):
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            item = ScheduleItemForm(session=self._copySessionToForm(session),
+                day=start.strftime('%Y-%m-%d'), startTime=start.strftime('%H:%M'),
+                endTime=end.strftime('%H:%M'))
+            for _, j in active:
+                item.conflicts.append(items[j].session.websafeSessionKey)
+                items[j].conflicts.append(item.session.websafeSessionKey)
+            items.append(item)
+            heapq.heappush(active, (end, i))
+        return ScheduleForms(items=items, unscheduled=unscheduled)
 
 
 # - - - Indexes and Queries - - - - - - - - - - - - - - - - - - - - - - - 
@@ -752,20 +1998,20 @@ class ConferenceApi(remote.Service):
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='lessThanFiveSeats',
             http_method='POST', name='lessThanFiveSeats')
+    @instrumented
     def lessThanFiveSeats(self, request):
         """Return conferences that have less than five slots available!"""
         q = Conference.query()
         q = q.filter(Conference.seatsAvailable<=5)
         
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(conf.key.parent().get(), 'displayName')) 
-            for conf in q])
+        return ConferenceForms(items=self._copyConferencesToForms(q.fetch()))
 
 
 # This query shows conferences that have a 'Workshop'
     @endpoints.method(message_types.VoidMessage, SessionForms,
             path='sessionIsWorkshop',
             http_method='POST', name='sessionIsWorkshop')
+    @instrumented
     def sessionIsWorkshop(self, request):
         """Returns sessions that are Workshops!"""
         q = Session.query()
@@ -781,21 +2027,27 @@ class ConferenceApi(remote.Service):
     def _cacheFeaturedSpeaker(speak):
         """Create and assign featured speaker to Memcache!"""
 
-        q = Session.query(Session.speaker==speak)
-        totalSessions = q.count()
+        speaker = ndb.Key(Speaker, speak).get()
 
-        if totalSessions >= 2:
-            featuredSpeaker = FEATURED_SPEAKER_TPL % (speak, speak, ', '.join(session.name for session in q))
-            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, featuredSpeaker)
+        if speaker and speaker.sessionCount >= 2:
+            featuredSpeaker = FEATURED_SPEAKER_TPL % (speak, speak, ', '.join(speaker.sessionNames))
+            caching.setVersionedIfChanged(MEMCACHE_FEATURED_SPEAKER_KEY,
+                MEMCACHE_FEATURED_SPEAKER_VERSION_KEY, featuredSpeaker)
 
         return
 
     # get the featured speaker
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(ETAG_REQUEST, StringMessage,
             path='featuredSpeaker',
             http_method='GET', name='getFeaturedSpeaker')
+    @instrumented
     def getFeaturedSpeaker(self, request):
         """Display memcache message for featured speaker!"""
-        return StringMessage(data=memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY) or "")
+        version, featuredSpeaker = caching.getVersioned(
+            MEMCACHE_FEATURED_SPEAKER_KEY, MEMCACHE_FEATURED_SPEAKER_VERSION_KEY)
+        if request.ifNoneMatch == str(version):
+            return StringMessage(data="", etag=request.ifNoneMatch,
+                notModified=True)
+        return StringMessage(data=featuredSpeaker or "", etag=str(version))
 
 api = endpoints.api_server([ConferenceApi]) # register API
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""export.py -- cursor-chained bulk export of conferences, sessions and profiles
+
+exportSlice writes the entities of one kind in key order as JSON lines
+or CSV, one fetch_page batch at a time, until the kind is exhausted or
+the slice's time or row budget runs out. In the second case it returns
+the cursor to pass back in for the next slice, so an export of any size
+is a chain of bounded requests and an interrupted one resumes where the
+last slice stopped.
+
+"""
+
+import csv
+import json
+import time
+from datetime import date
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference, Profile, Session
+
+EXPORT_BATCH = 200
+
+# exported columns per kind; computed ones are listed in COMPUTED
+KINDS = {
+    'Conference': (Conference, ['websafeKey', 'name', 'description',
+        'organizerUserId', 'organizerDisplayName', 'topics', 'city',
+        'startDate', 'month', 'endDate', 'maxAttendees', 'seatsAvailable']),
+    'Session': (Session, ['websafeKey', 'websafeConferenceKey', 'name',
+        'highlights', 'speaker', 'duration', 'typeOfSession', 'dateTime',
+        'startTime']),
+    'Profile': (Profile, ['userId', 'displayName', 'mainEmail',
+        'teeShirtSize', 'conferencesToAttend', 'wishlistSessions']),
+}
+
+COMPUTED = {
+    'websafeKey': lambda e: e.key.urlsafe(),
+    'websafeConferenceKey': lambda e: e.key.parent().urlsafe(),
+    'userId': lambda e: e.key.id(),
+}
+
+
+def _value(value):
+    """Return a property value as a JSON friendly value."""
+    if isinstance(value, ndb.Key):
+        return value.urlsafe()
+    if isinstance(value, date):     # dates and datetimes
+        return value.isoformat()
+    if isinstance(value, list):
+        return [_value(v) for v in value]
+    return value
+
+
+def row(entity, columns):
+    """Return the exported values of entity, in column order."""
+    if isinstance(entity, Profile):
+        # _post_get_hook doesn't run for query results
+        entity.migrateLegacyKeys()
+    return [_value(COMPUTED[c](entity) if c in COMPUTED else getattr(entity, c))
+        for c in columns]
+
+
+class JsonLinesWriter(object):
+    """JsonLinesWriter -- one JSON object per row"""
+    contentType = 'application/x-ndjson'
+
+    def __init__(self, out, columns):
+        self.out = out
+        self.columns = columns
+
+    def header(self):
+        pass
+
+    def write(self, values):
+        self.out.write(json.dumps(dict(zip(self.columns, values))) + '\n')
+
+
+class CsvWriter(object):
+    """CsvWriter -- header row, then one row per entity; lists are joined
+    with '|'"""
+    contentType = 'text/csv'
+
+    def __init__(self, out, columns):
+        self.csv = csv.writer(out)
+        self.columns = columns
+
+    def header(self):
+        self.csv.writerow(self.columns)
+
+    def write(self, values):
+        self.csv.writerow([self._cell(v) for v in values])
+
+    def _cell(self, value):
+        if value is None:
+            return ''
+        if isinstance(value, list):
+            value = '|'.join(unicode(v) for v in value)
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+
+WRITERS = {
+    'jsonl': JsonLinesWriter,
+    'csv': CsvWriter,
+}
+
+
+def exportSlice(kind, fmt, out, cursor=None, budget=45, maxRows=20000):
+    """Write one slice of the export of kind to out.
+
+    The CSV header is written only by the first slice (no cursor). Returns
+    the urlsafe cursor of the next slice, or None once the kind is done.
+    Raises datastore_errors.BadValueError for a malformed cursor.
+    """
+    model, columns = KINDS[kind]
+    writer = WRITERS[fmt](out, columns)
+    if cursor:
+        cursor = Cursor(urlsafe=cursor)
+    else:
+        writer.header()
+    deadline = time.time() + budget
+
+    query = model.query().order(model.key)
+    rows = 0
+    while True:
+        entities, cursor, more = query.fetch_page(EXPORT_BATCH,
+            start_cursor=cursor)
+        for entity in entities:
+            writer.write(row(entity, columns))
+        rows += len(entities)
+        if not more or cursor is None:
+            return None
+        if rows >= maxRows or time.time() >= deadline:
+            return cursor.urlsafe()
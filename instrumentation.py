@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""instrumentation.py -- sampled per-endpoint timings and RPC counts
+
+The instrumented decorator goes under @endpoints.method. For a sampled
+fraction of calls (STATS_SAMPLE_RATE) it records wall time, datastore
+gets, puts and queries, memcache hits and misses, taskqueue adds and
+the number of items in the response. An apiproxy hook does the counting
+for the calling thread only.
+
+Samples are added to memcache counters, one set per endpoint and
+STATS_WINDOW second window, in a single offset_multi call. Wall time
+goes into a fixed bucket histogram. stats() sums the last STATS_WINDOWS
+windows into a rolling view for the /admin/stats page.
+
+"""
+
+import functools
+import random
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+from settings import STATS_SAMPLE_RATE
+from settings import STATS_WINDOW
+from settings import STATS_WINDOWS
+
+STATS_NAMESPACE = 'stats'
+STATS_KEY = '%d:%s:%s'      # window, endpoint, metric
+
+# upper bounds (ms) of the wall time histogram buckets; the last is open
+LATENCY_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+
+METRICS = ['calls', 'errors', 'ms', 'rpcs', 'gets', 'puts', 'queries',
+    'mcHits', 'mcMisses', 'tasks', 'items']
+
+# names of all instrumented endpoints, for the stats page
+ENDPOINTS = []
+
+_local = threading.local()
+
+
+def _count(service, call, request, response):
+    """apiproxy post-call hook adding the RPC to the thread's counts."""
+    counts = getattr(_local, 'counts', None)
+    if counts is None:
+        return
+    if service == 'datastore_v3':
+        counts['rpcs'] += 1
+        if call == 'Get':
+            counts['gets'] += request.key_size()
+        elif call == 'Put':
+            counts['puts'] += request.entity_size()
+        elif call == 'RunQuery':
+            counts['queries'] += 1
+    elif service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        counts['mcHits'] += hits
+        counts['mcMisses'] += request.key_size() - hits
+    elif service == 'taskqueue':
+        if call == 'BulkAdd':
+            counts['tasks'] += request.add_request_size()
+        elif call == 'Add':
+            counts['tasks'] += 1
+
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'instrumentation', _count)
+
+
+def _bucket(ms):
+    """Return the histogram metric a wall time falls into."""
+    for bound in LATENCY_BUCKETS:
+        if ms <= bound:
+            return 'le%d' % bound
+    return 'inf'
+
+
+def _record(name, counts):
+    """Add one sample to the current window's counters."""
+    window = int(time.time() / STATS_WINDOW)
+    offsets = dict((STATS_KEY % (window, name, metric), value)
+        for metric, value in counts.iteritems() if value)
+    offsets[STATS_KEY % (window, name, _bucket(counts['ms']))] = 1
+    memcache.offset_multi(offsets, namespace=STATS_NAMESPACE,
+        initial_value=0)
+
+
+def instrumented(method):
+    """Record sampled stats of an endpoint method; use under
+    @endpoints.method."""
+    ENDPOINTS.append(method.__name__)
+
+    @functools.wraps(method)
+    def wrapper(self, request):
+        # nested calls are counted by the outer endpoint
+        if (getattr(_local, 'counts', None) is not None or
+                random.random() >= STATS_SAMPLE_RATE):
+            return method(self, request)
+
+        _local.counts = counts = dict.fromkeys(METRICS, 0)
+        counts['calls'] = 1
+        start = time.time()
+        try:
+            response = method(self, request)
+        except Exception:
+            counts['errors'] = 1
+            raise
+        else:
+            counts['items'] = len(getattr(response, 'items', None) or [])
+            return response
+        finally:
+            # ms is stored in whole milliseconds; counters are integers
+            counts['ms'] = int(1000 * (time.time() - start))
+            _local.counts = None
+            _record(method.__name__, counts)
+    return wrapper
+
+
+def stats():
+    """Return {endpoint: {metric: total}} over the rolling STATS_WINDOWS
+    windows, histogram buckets included."""
+    now = int(time.time() / STATS_WINDOW)
+    metrics = METRICS + [_bucket(b) for b in LATENCY_BUCKETS] + ['inf']
+    keys = [STATS_KEY % (window, name, metric)
+        for window in range(now - STATS_WINDOWS + 1, now + 1)
+        for name in ENDPOINTS for metric in metrics]
+    values = memcache.get_multi(keys, namespace=STATS_NAMESPACE)
+
+    totals = dict((name, dict.fromkeys(metrics, 0)) for name in ENDPOINTS)
+    for key, value in values.iteritems():
+        _, name, metric = key.split(':')
+        totals[name][metric] += value
+    return totals
+
+
+def percentile(total, pct):
+    """Return the histogram bucket bound (ms) under which pct percent of
+    the sampled calls finished, or None without samples."""
+    if not total['calls']:
+        return None
+    seen = 0
+    for bound in LATENCY_BUCKETS:
+        seen += total['le%d' % bound]
+        if seen >= total['calls'] * pct / 100.0:
+            return bound
+    return float('inf')
@@ -12,22 +12,40 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
+from google.appengine.api import datastore_errors
 from google.appengine.api import mail
 from google.appengine.api import memcache
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+import export
+import instrumentation
+import ratelimit
+import textindex
+from settings import EXPORT_TIME_BUDGET
+from settings import EXPORT_MAX_ROWS
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""
+        """Reconcile the Announcement and set it in Memcache."""
         ConferenceApi._cacheAnnouncement()
         self.response.set_status(204)
 
 
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send queued Conference creation confirmations in batches."""
+        ConferenceApi._sendConfirmationEmails()
+        self.response.set_status(204)
+
+
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation (push tasks queued
+        before confirmations moved to the pull queue)."""
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -45,8 +63,154 @@ class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class SeedSpeakersHandler(webapp2.RequestHandler):
+    def post(self):
+        """Add older sessions to new Speaker aggregates."""
+        ConferenceApi._seedSpeakers(self.request.get_all('speaker'))
+        self.response.set_status(204)
+
+
+class CountSpeakerSessionsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Count a batch of new sessions on their Speaker aggregates."""
+        ConferenceApi._countSpeakerSessions(
+            self.request.get_all('websafeSessionKey'))
+        self.response.set_status(204)
+
+
+class SyncSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy sharded seat counts back onto the Conference."""
+        ConferenceApi._syncSeatsAvailable(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy an organiser's display name onto their conferences."""
+        ConferenceApi._updateOrganizerName(self.request.get('userId'),
+            self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class MigrateProfilesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start moving Profile key strings to key lists."""
+        ConferenceApi._migrateProfiles()
+        self.response.set_status(204)
+
+    def post(self):
+        """Migrate the next batch of Profiles."""
+        ConferenceApi._migrateProfiles(self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class UpdateNearlySoldOutHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the nearly sold out set for one conference."""
+        ConferenceApi._updateNearlySoldOut(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+
+class PromoteWaitlistHandler(webapp2.RequestHandler):
+    def post(self):
+        """Move waitlisted users into freed seats."""
+        ConferenceApi._promoteWaitlist(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class IndexDocumentsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the search index for Conferences/Sessions."""
+        for wsk in self.request.get_all('websafeKey'):
+            textindex.indexDocument(ndb.Key(urlsafe=wsk))
+        self.response.set_status(204)
+
+
+class ReindexHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start indexing every Conference and Session for search."""
+        for kind in textindex.FIELDS:
+            ConferenceApi._reindex(kind)
+        self.response.set_status(204)
+
+    def post(self):
+        """Index the next batch of a kind."""
+        ConferenceApi._reindex(self.request.get('kind'),
+            self.request.get('cursor') or None)
+        self.response.set_status(204)
+
+
+class ExportHandler(webapp2.RequestHandler):
+    def get(self, kind):
+        """Write one slice of a bulk export of kind; the X-Export-Cursor
+        header, when set, is the cursor parameter of the next slice."""
+        fmt = self.request.get('format', 'jsonl')
+        if fmt not in export.WRITERS:
+            self.abort(400, 'format must be one of: %s' % ', '.join(export.WRITERS))
+        self.response.content_type = export.WRITERS[fmt].contentType
+        try:
+            cursor = export.exportSlice(kind, fmt, self.response.out,
+                self.request.get('cursor') or None,
+                EXPORT_TIME_BUDGET, EXPORT_MAX_ROWS)
+        except datastore_errors.BadValueError:
+            self.abort(400, 'Invalid cursor')
+        if cursor:
+            self.response.headers['X-Export-Cursor'] = cursor
+
+
+class StatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Show sampled per-endpoint stats of the last STATS_WINDOWS windows,
+        and the admitted/rejected counts of the rate limited endpoints."""
+        stats = instrumentation.stats()
+        limits = ratelimit.counters()
+        if self.request.get('format') == 'json':
+            for name, (admitted, rejected) in limits.iteritems():
+                stats[name].update(admitted=admitted, rejected=rejected)
+            self.response.content_type = 'application/json'
+            self.response.write(json.dumps(stats))
+            return
+
+        self.response.content_type = 'text/plain'
+        columns = ['calls', 'errors', 'p50', 'p95', 'p99', 'mean', 'rpcs',
+            'gets', 'puts', 'queries', 'mcHits', 'mcMisses', 'tasks', 'items']
+        self.response.write('%-28s' % 'endpoint' +
+            ''.join('%9s' % c for c in columns) + '\n')
+        for name in sorted(stats, key=lambda n: -stats[n]['ms']):
+            total = stats[name]
+            calls = total['calls']
+            if not calls:
+                continue
+            row = [calls, total['errors']] + [
+                instrumentation.percentile(total, pct) for pct in (50, 95, 99)]
+            row += [total[metric] / float(calls) for metric in ('ms', 'rpcs',
+                'gets', 'puts', 'queries', 'mcHits', 'mcMisses', 'tasks', 'items')]
+            self.response.write('%-28s' % name +
+                ''.join('%9.4g' % v for v in row) + '\n')
+
+        self.response.write('\n%-28s%9s%9s\n' % ('rate limited', 'admitted',
+            'rejected'))
+        for name in sorted(limits):
+            self.response.write('%-28s%9d%9d\n' % ((name,) + limits[name]))
+
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
+    ('/tasks/seed_speakers', SeedSpeakersHandler),
+    ('/tasks/count_speaker_sessions', CountSpeakerSessionsHandler),
+    ('/tasks/sync_seats', SyncSeatsHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/migrate_profiles', MigrateProfilesHandler),
+    ('/tasks/update_nearly_sold_out', UpdateNearlySoldOutHandler),
+    ('/tasks/promote_waitlist', PromoteWaitlistHandler),
+    ('/tasks/index_documents', IndexDocumentsHandler),
+    ('/tasks/reindex', ReindexHandler),
+    ('/admin/export/(Conference|Session|Profile)', ExportHandler),
+    ('/admin/stats', StatsHandler),
 ], debug=True)
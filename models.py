@@ -21,14 +21,86 @@ class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
 
+class TooManyRequestsException(endpoints.ServiceException):
+    """TooManyRequestsException -- exception mapped to HTTP 503 response
+    (Endpoints turns a 429 into a 404); the message says when to retry"""
+    http_status = httplib.SERVICE_UNAVAILABLE
+
 class Profile(ndb.Model):
     """Profile -- User profile object"""
     displayName            = ndb.StringProperty()
     mainEmail              = ndb.StringProperty()
     teeShirtSize           = ndb.StringProperty(default='NOT_SPECIFIED')
+    conferencesToAttend    = ndb.KeyProperty(kind='Conference', repeated=True)
+    wishlistSessions       = ndb.KeyProperty(kind='Session', repeated=True)
+    # legacy urlsafe key strings, moved to the key lists above on load
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
     sessionWishlist        = ndb.StringProperty(repeated=True)
 
+    def _keySet(self, name):
+        """Return a set mirroring repeated key property name, rebuilt only
+        when the list was replaced or changed size behind our back."""
+        keys = getattr(self, name)
+        sets = self.__dict__.setdefault('_keySets', {})
+        cached = sets.get(name)
+        if cached is None or cached[0] is not keys or len(cached[1]) != len(keys):
+            cached = sets[name] = (keys, set(keys))
+        return cached[1]
+
+    def _addKey(self, name, key):
+        """Add key to a repeated key property; False if already there."""
+        keys = self._keySet(name)
+        if key in keys:
+            return False
+        getattr(self, name).append(key)
+        keys.add(key)
+        return True
+
+    def _removeKey(self, name, key):
+        """Remove key from a repeated key property; False if absent."""
+        keys = self._keySet(name)
+        if key not in keys:
+            return False
+        getattr(self, name).remove(key)
+        keys.discard(key)
+        return True
+
+    def attends(self, c_key):
+        return c_key in self._keySet('conferencesToAttend')
+
+    def addConference(self, c_key):
+        return self._addKey('conferencesToAttend', c_key)
+
+    def removeConference(self, c_key):
+        return self._removeKey('conferencesToAttend', c_key)
+
+    def wishlists(self, s_key):
+        return s_key in self._keySet('wishlistSessions')
+
+    def addToWishlist(self, s_key):
+        return self._addKey('wishlistSessions', s_key)
+
+    def removeFromWishlist(self, s_key):
+        return self._removeKey('wishlistSessions', s_key)
+
+    def migrateLegacyKeys(self):
+        """Move legacy urlsafe strings to the key lists; True if any moved."""
+        if not (self.conferenceKeysToAttend or self.sessionWishlist):
+            return False
+        for wsck in self.conferenceKeysToAttend:
+            self.addConference(ndb.Key(urlsafe=wsck))
+        for wssk in self.sessionWishlist:
+            self.addToWishlist(ndb.Key(urlsafe=wssk))
+        self.conferenceKeysToAttend = []
+        self.sessionWishlist = []
+        return True
+
+    @classmethod
+    def _post_get_hook(cls, key, future):
+        prof = future.get_result()
+        if prof:
+            prof.migrateLegacyKeys()
+
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
     displayName  = messages.StringField(1)
@@ -42,7 +114,9 @@ class ProfileForm(messages.Message):
 
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
-    data = messages.StringField(1, required=True)
+    data        = messages.StringField(1, required=True)
+    etag        = messages.StringField(2)
+    notModified = messages.BooleanField(3)
 
 class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
@@ -60,6 +134,24 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0)
+    organizerDisplayName = ndb.StringProperty()
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- conferences listed in the announcement (singleton)"""
+    conferenceKeys  = ndb.KeyProperty(kind='Conference', repeated=True, indexed=False)
+    conferenceNames = ndb.StringProperty(repeated=True, indexed=False)
+
+class WaitlistEntry(ndb.Model):
+    """WaitlistEntry -- a user waiting for a seat at a sold out conference,
+    keyed '<websafe conference key>:<user id>'"""
+    conference = ndb.KeyProperty(kind='Conference')
+    userId     = ndb.StringProperty(indexed=False)
+    joined     = ndb.DateTimeProperty(auto_now_add=True)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- slice of a sharded Conference's seat inventory"""
+    seatsAvailable = ndb.IntegerProperty(default=0)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -75,10 +167,25 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10)
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
+
+class ConferenceSummaryForm(messages.Message):
+    """ConferenceSummaryForm -- slim Conference outbound form message for
+    list views"""
+    name           = messages.StringField(1)
+    city           = messages.StringField(2)
+    startDate      = messages.StringField(3)
+    endDate        = messages.StringField(4)
+    seatsAvailable = messages.IntegerField(5)
+    websafeKey     = messages.StringField(6)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
-    items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    items      = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextCursor = messages.StringField(2)
+    plan       = messages.StringField(3)
+    summaries  = messages.MessageField(ConferenceSummaryForm, 4, repeated=True)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -106,7 +213,11 @@ class ConferenceQueryForm(messages.Message):
 
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
-    filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    filters  = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    cursor   = messages.StringField(3)
+    explain  = messages.BooleanField(4)
+    view     = messages.StringField(5)
 
 class Session(ndb.Model):
     """Session -- Session object"""
@@ -118,6 +229,45 @@ class Session(ndb.Model):
     dateTime      = ndb.DateTimeProperty()
     startTime     = ndb.StringProperty()
 
+class Speaker(ndb.Model):
+    """Speaker -- sessions given by a speaker, keyed by speaker name;
+    seeded is False until sessions from before the aggregate are added"""
+    sessionCount = ndb.IntegerProperty(default=0)
+    sessionKeys  = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+    sessionNames = ndb.StringProperty(repeated=True, indexed=False)
+    seeded       = ndb.BooleanProperty(default=True, indexed=False)
+
+class SessionIndex(ndb.Model):
+    """SessionIndex -- a conference's sessions by hour, keyed by websafe
+    conference key; buckets maps 'YYYY-MM-DD HH' (or '' for sessions
+    without a start) to [session id, start minute, duration, type] rows"""
+    buckets = ndb.JsonProperty()
+
+class SpeakerBoard(ndb.Model):
+    """SpeakerBoard -- a conference's speakers ranked by session count,
+    keyed by websafe conference key; ranking holds [speaker, count] rows"""
+    ranking = ndb.JsonProperty()
+
+class SearchTerm(ndb.Model):
+    """SearchTerm -- postings of one shard of a term, keyed
+    '<kind>:<term>:<shard>'; each posting is [websafe key, term frequency,
+    document length], and documents counts the shard's documents with the
+    term, evicted postings included"""
+    postings  = ndb.JsonProperty(compressed=True)
+    documents = ndb.IntegerProperty(default=0, indexed=False)
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- terms and length a document was last indexed
+    with, keyed by the document's websafe key"""
+    terms  = ndb.StringProperty(repeated=True, indexed=False)
+    length = ndb.IntegerProperty(default=0, indexed=False)
+
+class SearchStats(ndb.Model):
+    """SearchStats -- document count and total length of one shard of a
+    kind, keyed '<kind>' (shard 0) or '<kind>:<shard>'"""
+    documents   = ndb.IntegerProperty(default=0, indexed=False)
+    totalLength = ndb.IntegerProperty(default=0, indexed=False)
+
 class SessionForm(messages.Message):
     """Session -- Session outbound form message"""
     name                 = messages.StringField(1)
@@ -144,6 +294,61 @@ class SessionForms(messages.Message):
     """SessionForms -- multiple Session outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
     
+class ScheduleItemForm(messages.Message):
+    """ScheduleItemForm -- one wishlisted session in an itinerary"""
+    session   = messages.MessageField(SessionForm, 1)
+    day       = messages.StringField(2)
+    startTime = messages.StringField(3)
+    endTime   = messages.StringField(4)
+    conflicts = messages.StringField(5, repeated=True)
+
+class ScheduleForms(messages.Message):
+    """ScheduleForms -- wishlist itinerary outbound form message"""
+    items       = messages.MessageField(ScheduleItemForm, 1, repeated=True)
+    unscheduled = messages.MessageField(SessionForm, 2, repeated=True)
+
+class SpeakerRankForm(messages.Message):
+    """SpeakerRankForm -- a speaker and their session count"""
+    speaker      = messages.StringField(1)
+    sessionCount = messages.IntegerField(2)
+
+class SpeakerRankForms(messages.Message):
+    """SpeakerRankForms -- top speakers of a conference"""
+    items = messages.MessageField(SpeakerRankForm, 1, repeated=True)
+
+class SessionCreateForms(messages.Message):
+    """SessionCreateForms -- multiple Session inbound form message"""
+    items = messages.MessageField(SessionForm, 1, repeated=True)
+
+class SessionCreateResult(messages.Message):
+    """SessionCreateResult -- created Session or why it was rejected"""
+    session = messages.MessageField(SessionForm, 1)
+    error   = messages.StringField(2)
+
+class SessionCreateResults(messages.Message):
+    """SessionCreateResults -- per item results of createSessions"""
+    items = messages.MessageField(SessionCreateResult, 1, repeated=True)
+
+class SessionSearchForm(messages.Message):
+    """SessionSearchForm -- session search inbound form message"""
+    date         = messages.StringField(1)
+    startAfter   = messages.StringField(2)
+    startBefore  = messages.StringField(3)
+    includeTypes = messages.EnumField('SessionType', 4, repeated=True)
+    excludeTypes = messages.EnumField('SessionType', 5, repeated=True)
+    maxDuration  = messages.IntegerField(6)
+
+class SearchResultForm(messages.Message):
+    """SearchResultForm -- one ranked search hit"""
+    score      = messages.FloatField(1)
+    conference = messages.MessageField(ConferenceForm, 2)
+    session    = messages.MessageField(SessionForm, 3)
+
+class SearchResultForms(messages.Message):
+    """SearchResultForms -- one page of search hits"""
+    items         = messages.MessageField(SearchResultForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
 class SessionType(messages.Enum):
     """SessionType -- session type enumeration value"""
     NOT_SPECIFIED = 1
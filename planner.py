@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+"""planner.py -- query planner for queryConferences
+
+The datastore accepts inequality filters on one property per query and
+needs a composite index for every filter/sort combination. The planner
+takes any mix of parsed filters, picks the cheapest part of them that an
+index in INDEXES can serve, runs that in the datastore, and applies the
+rest (including every NE) in memory as results stream in.
+
+INDEXES mirrors the Conference indexes in index.yaml, which is deploy
+configuration and not uploaded with the code; tests/test_planner.py
+checks that the two agree.
+
+"""
+
+import operator
+import os
+from itertools import combinations
+
+from google.appengine.ext import ndb
+
+from models import Conference
+
+INDEX_YAML = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'index.yaml')
+
+# rough fraction of conferences an equality filter keeps
+EQ_SELECTIVITY = {
+    'city': 0.05,
+    'topics': 0.1,
+    'month': 1 / 12.0,
+    'maxAttendees': 0.05,
+}
+# fraction kept by each bound of a range filter
+RANGE_SELECTIVITY = 1 / 3.0
+
+COMPARE = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+}
+
+
+# Conference composite indexes (no ancestor) as tuples of property names;
+# keep in step with index.yaml
+INDEXES = frozenset([
+    ('name', 'city', 'endDate', 'seatsAvailable', 'startDate'),
+    ('city', 'name', 'endDate', 'seatsAvailable', 'startDate'),
+    ('city', 'maxAttendees', 'name'),
+    ('city', 'month', 'maxAttendees', 'name'),
+    ('city', 'month', 'name'),
+    ('city', 'name'),
+    ('maxAttendees', 'name'),
+    ('seatsAvailable', 'name'),
+    ('seatsAvailable', 'startDate'),
+    ('startDate', 'seatsAvailable'),
+])
+
+
+def loadIndexes(path=INDEX_YAML):
+    """Return the Conference composite indexes in index.yaml as tuples of
+    property names; raises if the file can't be read or parsed."""
+    import yaml
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    return frozenset(tuple(prop['name'] for prop in index.get('properties', []))
+        for index in config.get('indexes') or []
+        if index.get('kind') == 'Conference' and not index.get('ancestor'))
+
+
+class QueryPlan(object):
+    """QueryPlan -- datastore part and in-memory part of a conference query"""
+
+    def __init__(self, pushed, residual, orderField, index, cost):
+        self.pushed = pushed
+        self.residual = residual
+        self.orderField = orderField
+        self.index = index
+        self.cost = cost
+
+    def query(self):
+        """Return the ndb query for the datastore part of the plan."""
+        q = Conference.query()
+        for filtr in self.pushed:
+            q = q.filter(ndb.query.FilterNode(
+                filtr["field"], filtr["operator"], filtr["value"]))
+        if self.orderField:
+            q = q.order(ndb.GenericProperty(self.orderField))
+        # a final key order keeps cursors valid should a filter ever make
+        # this a multi-query; indexes end in the key anyway
+        return q.order(Conference.name, Conference.key)
+
+    def matches(self, conf):
+        """Return True if conf passes the in-memory filters."""
+        for filtr in self.residual:
+            value = getattr(conf, filtr["field"])
+            values = value if isinstance(value, list) else [value]
+            compare = COMPARE[filtr["operator"]]
+            if not any(v is not None and compare(v, filtr["value"])
+                    for v in values):
+                return False
+        return True
+
+    def projection(self, props):
+        """Return (projection, known) to read props with a projection
+        query, or None when no index in index.yaml serves one or the
+        in-memory filters need properties it leaves out.
+
+        Equality filtered properties can't be projected; known maps
+        those among props to their filter value instead.
+        """
+        if self.residual:
+            return None
+        known = dict((f["field"], f["value"]) for f in self.pushed
+            if f["operator"] == '=')
+        tail = tuple(filter(None, [self.orderField, 'name']))
+        projection = tuple(p for p in props if p not in known)
+        rest = set(projection) - set(tail)
+        n = len(known)
+        for index in INDEXES:
+            if (set(index[:n]) == set(known) and
+                    index[n:n + len(tail)] == tail and
+                    set(index[n + len(tail):]) == rest):
+                return projection, dict((p, known[p]) for p in props if p in known)
+        return None
+
+    def explain(self):
+        """Describe the plan in one line."""
+        describe = lambda filters: ' AND '.join('%s %s %r' % (
+            f["field"], f["operator"], f["value"]) for f in filters) or '-'
+        order = ', '.join(filter(None, [self.orderField, 'name']))
+        return ('datastore: %s ORDER BY %s using %s; in memory: %s; '
+            'estimated rows scanned: %.4f of all conferences' % (
+            describe(self.pushed), order,
+            'index (%s)' % ', '.join(self.index) if self.index
+                else 'built-in index', describe(self.residual), self.cost))
+
+
+def _servable(eqFields, orderField):
+    """Return the index serving equality filters on eqFields with the
+    (orderField, name) sort, or None when index.yaml has none."""
+    if not eqFields and not orderField:
+        return ()
+    tail = tuple(filter(None, [orderField, 'name']))
+    for index in INDEXES:
+        if (index[len(eqFields):] == tail and
+                set(index[:len(eqFields)]) == set(eqFields)):
+            return index
+    return None
+
+
+def plan(filters):
+    """Return the cheapest QueryPlan for a list of parsed filters.
+
+    Each filter is a dict with "field", "operator" and "value" keys.
+    """
+    eqFields = sorted(set(f["field"] for f in filters if f["operator"] == '='))
+    rangeFields = sorted(set(f["field"] for f in filters
+        if f["operator"] not in ('=', '!=')))
+
+    best = None
+    for size in range(len(eqFields) + 1):
+        for pushedEq in combinations(eqFields, size):
+            for orderField in [None] + rangeFields:
+                index = _servable(pushedEq, orderField)
+                if index is None:
+                    continue
+                pushed = [f for f in filters if
+                    (f["operator"] == '=' and f["field"] in pushedEq) or
+                    (f["operator"] not in ('=', '!=') and f["field"] == orderField)]
+                cost = 1.0
+                for f in pushed:
+                    cost *= (EQ_SELECTIVITY.get(f["field"], 0.5)
+                        if f["operator"] == '=' else RANGE_SELECTIVITY)
+                if best is None or cost < best.cost:
+                    residual = [f for f in filters if f not in pushed]
+                    best = QueryPlan(pushed, residual, orderField, index, cost)
+    return best
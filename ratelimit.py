@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""ratelimit.py -- token bucket admission control for write endpoints
+
+The ratelimited decorator goes under @instrumented. Before the endpoint
+runs, it takes one token (or cost(request) tokens, capped at the bucket's
+capacity) each from the calling user's bucket and from the target
+conference's bucket. When either bucket is empty, it raises
+TooManyRequestsException with the seconds until a token is back, so the
+request is shed before any transaction starts.
+
+Buckets live in memcache as (tokens, updated) pairs and are updated with
+compare-and-set: one get_multi plus one cas_multi for both buckets.
+When a bucket turns out to be empty, this instance remembers that until
+it refills. Later requests for that bucket are then rejected without
+any RPC, which is what a retry storm mostly consists of. If memcache is
+unavailable or contended, requests are admitted.
+
+Admitted and rejected counts are kept per endpoint in process and added
+to memcache every PUBLISH_INTERVAL seconds for the /admin/stats page.
+
+"""
+
+import functools
+import math
+import threading
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from caching import LRUCache
+from models import TooManyRequestsException
+from settings import RATE_LIMITS
+from utils import getUserId
+
+RATE_NAMESPACE = 'ratelimit'
+RATE_KEY = 'RATE:%s:%s'         # bucket kind, id
+COUNTER_KEY = '%s:%s'           # admitted/rejected, endpoint
+CAS_ATTEMPTS = 3
+PUBLISH_INTERVAL = 10
+
+# names of all rate limited endpoints, for the stats page
+ENDPOINTS = []
+
+_blocked = LRUCache(10000)
+_counts = {}
+_lock = threading.Lock()
+_published = [time.time()]
+
+
+def _refill(state, capacity, rate, now):
+    """Return the tokens in a bucket stored as state at time now."""
+    if state is None:
+        return float(capacity)
+    tokens, updated = state
+    return min(float(capacity), tokens + (now - updated) * rate)
+
+
+def _take(buckets, cost=1):
+    """Take cost tokens from every (kind, id) bucket, or from none of them;
+    a bucket is never charged more than its capacity.
+
+    Returns None when admitted, else the seconds until the emptiest
+    bucket has a token again.
+    """
+    keys = dict((RATE_KEY % bucket, RATE_LIMITS[bucket[0]]) for bucket in buckets)
+    now = time.time()
+    retryAfter = max([_blocked.get(key) or 0 for key in keys]) - now
+    if retryAfter > 0:
+        return retryAfter
+
+    client = memcache.Client()
+    for _ in range(CAS_ATTEMPTS):
+        now = time.time()
+        states = client.get_multi(keys.keys(), namespace=RATE_NAMESPACE,
+            for_cas=True)
+        updates, new = {}, {}
+        retryAfter = 0
+        for key, (capacity, rate) in keys.iteritems():
+            tokens = _refill(states.get(key), capacity, rate, now)
+            need = min(cost, capacity)
+            if tokens < need:
+                wait = (need - tokens) / rate
+                _blocked.set(key, now + wait, expires=now + wait)
+                retryAfter = max(retryAfter, wait)
+            (updates if key in states else new)[key] = (tokens - need, now)
+        if retryAfter:
+            return retryAfter
+
+        # keep an idle bucket around for as long as it takes to refill
+        ttl = int(max(float(capacity) / rate
+            for capacity, rate in keys.values())) + 60
+        failed = []
+        if updates:
+            failed += client.cas_multi(updates, time=ttl,
+                namespace=RATE_NAMESPACE) or []
+        if new:
+            failed += client.add_multi(new, time=ttl,
+                namespace=RATE_NAMESPACE) or []
+        if not failed:
+            return None
+        # someone else moved a bucket in between; tokens taken from the
+        # other buckets in this attempt stay taken, which only errs on
+        # the strict side
+        keys = dict((key, keys[key]) for key in failed)
+    return None
+
+
+def _count(name, outcome):
+    """Count an admission outcome and publish the counts now and then."""
+    with _lock:
+        key = COUNTER_KEY % (outcome, name)
+        _counts[key] = _counts.get(key, 0) + 1
+        if time.time() - _published[0] < PUBLISH_INTERVAL:
+            return
+        counts = dict(_counts)
+        _counts.clear()
+        _published[0] = time.time()
+    memcache.offset_multi(counts, namespace=RATE_NAMESPACE, initial_value=0)
+
+
+def counters():
+    """Return {endpoint: (admitted, rejected)} as published so far."""
+    keys = [COUNTER_KEY % (outcome, name) for name in ENDPOINTS
+        for outcome in ('admitted', 'rejected')]
+    values = memcache.get_multi(keys, namespace=RATE_NAMESPACE)
+    return dict((name, (values.get(COUNTER_KEY % ('admitted', name), 0),
+        values.get(COUNTER_KEY % ('rejected', name), 0))) for name in ENDPOINTS)
+
+
+def ratelimited(target, cost=None):
+    """Shed calls of an endpoint method while the calling user or the
+    conference named by target(request) (a websafe key, or None) is over
+    its RATE_LIMITS; cost(request), if given, is the tokens a call takes.
+    Use under @instrumented."""
+    def decorator(method):
+        ENDPOINTS.append(method.__name__)
+
+        @functools.wraps(method)
+        def wrapper(self, request):
+            buckets = []
+            wsck = target(request)
+            if wsck:
+                buckets.append(('conference', wsck))
+            user = endpoints.get_current_user()
+            if user:
+                buckets.append(('user', getUserId(user)))
+            retryAfter = _take(buckets,
+                cost(request) if cost else 1) if buckets else None
+            if retryAfter:
+                _count(method.__name__, 'rejected')
+                raise TooManyRequestsException(
+                    'Too many requests; retry after %d seconds.' %
+                    math.ceil(retryAfter))
+            _count(method.__name__, 'admitted')
+            return method(self, request)
+        return wrapper
+    return decorator
@@ -16,3 +16,38 @@ WEB_CLIENT_ID = '625652467880-gl9dns44ltglaf0qom52u3se2kfkj2vc.apps.googleuserco
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Number of seat counter shards given to each new conference. 0 keeps the
+# seat inventory on the Conference entity itself; raise it for conferences
+# expecting flash-sale registration bursts (at most 20, so a capacity
+# change still fits in one cross-group transaction).
+SEAT_SHARDS = 0
+
+# Seconds between re-syncs of Conference.seatsAvailable from its shards.
+SEAT_SYNC_INTERVAL = 5
+
+# Entries kept in the per-instance LRU in front of memcache for rendered
+# conferences; 0 disables it.
+CONFERENCE_LRU_SIZE = 1000
+
+# Seconds and rows one /admin/export request may spend before it stops
+# and hands back an X-Export-Cursor to continue from (requests have a
+# 60 second deadline and a 32MB response limit).
+EXPORT_TIME_BUDGET = 45
+EXPORT_MAX_ROWS = 20000
+
+# Fraction of endpoint calls whose timings and RPC counts are recorded
+# for /admin/stats (0 turns instrumentation off), the length in seconds
+# of one stats window, and how many windows the page sums up.
+STATS_SAMPLE_RATE = 0.01
+STATS_WINDOW = 300
+STATS_WINDOWS = 12
+
+# Token buckets in front of the transactional write endpoints
+# (registerForConference, addToWishlist, createSession), as (burst,
+# tokens refilled per second): one bucket per user and one per target
+# conference. A call takes a token from both or is shed with a retry hint.
+RATE_LIMITS = {
+    'user': (10, 1.0),
+    'conference': (200, 50.0),
+}
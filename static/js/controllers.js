@@ -293,6 +293,23 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.conferences = [];
 
+    /**
+     * Holds the cursor of the next page of the 'ALL' query, if there is one.
+     * @type {string}
+     */
+    $scope.nextCursor = undefined;
+
+    /**
+     * Identifies the latest query; responses to older ones are dropped.
+     * @type {number}
+     */
+    var queryId = 0;
+
+    /**
+     * Holds the filters the current 'ALL' query was sent with.
+     */
+    var lastFilters;
+
     /**
      * Holds the state if offcanvas is enabled.
      *
@@ -414,6 +431,8 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        queryId++;
+        $scope.nextCursor = undefined;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -424,7 +443,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     };
 
     /**
-     * Invokes the conference.queryConferences API.
+     * Invokes the conference.queryConferences API for the first page of the filters.
      */
     $scope.queryConferencesAll = function () {
         var sendFilters = {
@@ -440,9 +459,34 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                 });
             }
         }
+        sendFilters.pageSize = 100;
+        lastFilters = sendFilters;
+        $scope.conferences = [];
+        $scope.pagination.currentPage = 0;
+        fetchPage(sendFilters, undefined);
+    }
+
+    /**
+     * Appends the next page of the current 'ALL' query.
+     */
+    $scope.loadMoreConferences = function () {
+        if ($scope.nextCursor && !$scope.loading) {
+            fetchPage(lastFilters, $scope.nextCursor);
+        }
+    };
+
+    /**
+     * Fetches one page of conference.queryConferences and appends it, unless
+     * another query has been started in the meantime.
+     */
+    var fetchPage = function (sendFilters, cursor) {
+        var id = queryId;
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
+        gapi.client.conference.queryConferences(angular.extend({cursor: cursor}, sendFilters)).
             execute(function (resp) {
+                if (id != queryId) {
+                    return;
+                }
                 $scope.$apply(function () {
                     $scope.loading = false;
                     if (resp.error) {
@@ -453,28 +497,31 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $log.error($scope.messages + ' filters : ' + JSON.stringify(sendFilters));
                     } else {
                         // The request has succeeded.
+                        angular.forEach(resp.items, function (conference) {
+                            $scope.conferences.push(conference);
+                        });
+                        $scope.nextCursor = resp.nextCursor;
                         $scope.submitted = false;
                         $scope.messages = 'Query succeeded : ' + JSON.stringify(sendFilters);
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
-
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
                     }
                     $scope.submitted = true;
                 });
             });
-    }
+    };
 
     /**
      * Invokes the conference.getConferencesCreated method.
      */
     $scope.getConferencesCreated = function () {
+        var id = queryId;
         $scope.loading = true;
         gapi.client.conference.getConferencesCreated().
             execute(function (resp) {
+                if (id != queryId) {
+                    return;
+                }
                 $scope.$apply(function () {
                     $scope.loading = false;
                     if (resp.error) {
@@ -510,9 +557,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      * invokes the conference.getConference method n times where n == the number of the conferences to attend.
      */
     $scope.getConferencesAttend = function () {
+        var id = queryId;
         $scope.loading = true;
         gapi.client.conference.getConferencesToAttend().
             execute(function (resp) {
+                if (id != queryId) {
+                    return;
+                }
                 $scope.$apply(function () {
                     if (resp.error) {
                         // The request has failed.
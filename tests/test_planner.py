@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+"""test_planner.py -- planner.INDEXES must match index.yaml
+
+Set APPENGINE_SDK to the Python SDK directory (the one holding
+dev_appserver.py) and run from the repo root:
+
+    python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SDK = os.environ.get('APPENGINE_SDK', '/usr/local/google_appengine')
+
+sys.path.insert(0, SDK)
+import dev_appserver
+dev_appserver.fix_sys_path()
+sys.path.insert(0, ROOT)
+
+import planner
+
+
+class IndexesTest(unittest.TestCase):
+
+    def test_indexes_match_index_yaml(self):
+        self.assertEqual(planner.INDEXES, planner.loadIndexes())
+
+    def test_load_indexes_fails_loudly(self):
+        with self.assertRaises(IOError):
+            planner.loadIndexes(os.path.join(ROOT, 'missing.yaml'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+"""textindex.py -- inverted index and BM25 ranking for conference search
+
+Conference name/description/topics and Session name/highlights/speaker
+are tokenized into SearchTerm entities holding the postings of the
+documents containing a term. Each kind and term has POSTING_SHARDS of
+them, and a document's postings go to the shard picked by its key, so
+indexing documents that share a common term doesn't contend on one
+entity. indexDocument brings one document's postings up to date. It
+runs from a task queued when the document is written, so a search is a
+batch get of the query terms' shards plus in-memory scoring.
+
+A shard keeps at most MAX_POSTINGS postings. Past that, adding a posting
+evicts the shard's oldest one, so new documents always stay findable.
+Evicted documents still count in the shard's documents total, so the
+term's document frequency, and with it the ranking, stays exact.
+
+The last query token also matches as a prefix (search as you type),
+expanded to at most PREFIX_EXPANSIONS terms through a key range scan.
+
+Document counts and lengths per kind are spread over STATS_SHARDS
+SearchStats entities, so concurrent indexing doesn't queue up on one
+entity; a search reads and sums all of them.
+
+"""
+
+import math
+import re
+import zlib
+from collections import defaultdict
+
+from google.appengine.ext import ndb
+
+from models import SearchDocument, SearchStats, SearchTerm
+
+FIELDS = {
+    'Conference': ['name', 'description', 'topics'],
+    'Session': ['name', 'highlights', 'speaker'],
+}
+
+STOP_WORDS = frozenset(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by',
+    'for', 'from', 'in', 'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with'])
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+PREFIX_EXPANSIONS = 20
+POSTING_SHARDS = 8
+# postings kept per term shard, bounding what one indexed document costs
+# to rewrite; a term in more documents than the shards hold says next to
+# nothing about relevance, so losing the oldest postings costs little
+MAX_POSTINGS = 2000
+STATS_SHARDS = 10
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Return the lower-cased index terms in text, in order."""
+    return [t for t in _TOKEN_RE.findall(text.lower())
+        if t not in STOP_WORDS]
+
+
+def _documentTerms(entity):
+    """Return {term: frequency} and the length of an entity's text."""
+    counts = defaultdict(int)
+    for field in FIELDS[entity.key.kind()]:
+        value = getattr(entity, field)
+        for text in value if isinstance(value, list) else [value]:
+            for term in tokenize(text or u''):
+                counts[term] += 1
+    return counts, sum(counts.itervalues())
+
+
+def _termKeys(kind, term):
+    """Return the keys of all SearchTerm shards of a term."""
+    return [ndb.Key(SearchTerm, u'%s:%s:%d' % (kind, term, shard))
+        for shard in range(POSTING_SHARDS)]
+
+
+def _termKey(kind, term, wsk):
+    """Return the key of the SearchTerm shard holding a document's
+    posting of a term."""
+    return _termKeys(kind, term)[zlib.crc32(wsk) % POSTING_SHARDS]
+
+
+def _statsKeys(kind):
+    """Return the keys of all SearchStats shards of kind; shard 0 is the
+    entity kept before stats were sharded."""
+    return [ndb.Key(SearchStats, kind)] + [
+        ndb.Key(SearchStats, '%s:%d' % (kind, shard))
+        for shard in range(1, STATS_SHARDS)]
+
+
+def _statsKey(kind, wsk):
+    """Return the key of the SearchStats shard a document counts on."""
+    return _statsKeys(kind)[zlib.crc32(wsk) % STATS_SHARDS]
+
+
+@ndb.transactional_tasklet
+def _setPosting(t_key, wsk, tf, length, counted):
+    """Set (or with tf 0, remove) one document's posting of a term shard;
+    counted tells if the shard's documents total already includes it."""
+    term = yield t_key.get_async()
+    old = term.postings if term else []
+    postings = [p for p in old if p[0] != wsk]
+    documents = term.documents if term else 0
+    counted = counted or len(postings) < len(old)
+    if tf:
+        if [wsk, tf, length] in old:
+            return
+        # newest last; evict the oldest postings once the shard is full
+        postings.append([wsk, tf, length])
+        postings = postings[-MAX_POSTINGS:]
+        documents += 0 if counted else 1
+    else:
+        if not counted:
+            return
+        documents -= 1
+    # a total can't be below the postings it holds
+    documents = max(documents, len(postings))
+    if documents > 0:
+        yield SearchTerm(key=t_key, postings=postings,
+            documents=documents).put_async()
+    else:
+        yield t_key.delete_async()
+
+
+@ndb.transactional(xg=True)
+def _setDocument(kind, d_key, terms, length, exists):
+    """Record what a document was indexed with and update its stats
+    shard in one transaction; returns False if another run did it."""
+    doc = d_key.get()
+    if not doc and not exists:
+        return False
+    st_key = _statsKey(kind, d_key.id())
+    stats = st_key.get() or SearchStats(key=st_key)
+    if doc:
+        if exists and sorted(doc.terms) == sorted(terms) and doc.length == length:
+            return False
+        stats.documents -= 1
+        stats.totalLength -= doc.length
+    if exists:
+        stats.documents += 1
+        stats.totalLength += length
+        ndb.put_multi([SearchDocument(key=d_key, terms=terms, length=length),
+            stats])
+    else:
+        stats.put()
+        d_key.delete()
+    return True
+
+
+def indexDocument(key):
+    """Bring the index up to date with the Conference or Session at key
+    (removing it if the entity is gone); safe to run more than once."""
+    kind = key.kind()
+    wsk = key.urlsafe()
+    entity = key.get()
+    counts, length = _documentTerms(entity) if entity else ({}, 0)
+
+    # postings first, so a failed run leaves the document to redo
+    d_key = ndb.Key(SearchDocument, wsk)
+    doc = d_key.get()
+    indexed = set(doc.terms if doc else [])
+    futures = [_setPosting(_termKey(kind, term, wsk), wsk, tf, length,
+        term in indexed) for term, tf in counts.iteritems()]
+    futures += [_setPosting(_termKey(kind, term, wsk), wsk, 0, 0, True)
+        for term in indexed - set(counts)]
+    ndb.Future.wait_all(futures)
+    for future in futures:
+        future.check_success()
+
+    # terms records what the shards' documents totals count
+    _setDocument(kind, d_key, sorted(counts), length, entity is not None)
+
+
+def _prefixTerms(kind, prefix):
+    """Return up to PREFIX_EXPANSIONS terms starting with prefix."""
+    lo = ndb.Key(SearchTerm, u'%s:%s' % (kind, prefix))
+    hi = ndb.Key(SearchTerm, u'%s:%s\ufffd' % (kind, prefix))
+    keys = SearchTerm.query(SearchTerm.key >= lo, SearchTerm.key < hi).fetch(
+        PREFIX_EXPANSIONS * POSTING_SHARDS, keys_only=True)
+    terms = []
+    for key in keys:
+        term = key.id().split(':')[1]   # '<kind>:<term>:<shard>'
+        if term not in terms:
+            terms.append(term)
+    return terms[:PREFIX_EXPANSIONS]
+
+
+def search(query, kinds, limit):
+    """Return up to limit (score, websafe key) pairs for query, best
+    first, over the given kinds."""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    scores = defaultdict(float)
+    for kind in kinds:
+        terms = set(tokens)
+        terms.update(_prefixTerms(kind, tokens[-1]))
+        t_keys = [key for term in terms for key in _termKeys(kind, term)]
+        entities = ndb.get_multi(_statsKeys(kind) + t_keys)
+        stats = entities[:STATS_SHARDS]
+        documents = sum(st.documents for st in stats if st)
+        if documents <= 0:
+            continue
+        totalLength = sum(st.totalLength for st in stats if st)
+        avgLength = float(totalLength) / documents or 1.0
+        shards = entities[STATS_SHARDS:]
+        for i in range(0, len(shards), POSTING_SHARDS):
+            found = [t for t in shards[i:i + POSTING_SHARDS] if t]
+            df = sum(t.documents for t in found)
+            if not df:
+                continue
+            idf = math.log(1 + (documents - df + 0.5) / (df + 0.5))
+            for t in found:
+                for wsk, tf, length in t.postings:
+                    scores[wsk] += idf * tf * (K1 + 1) / (
+                        tf + K1 * (1 - B + B * length / avgLength))
+    ranked = sorted(scores.iteritems(), key=lambda item: -item[1])
+    return [(score, wsk) for wsk, score in ranked[:limit]]
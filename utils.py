@@ -1,11 +1,71 @@
+import hashlib
 import json
 import os
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
 
+from caching import LRUCache
+
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+MEMCACHE_TOKENINFO_KEY = 'TOKENINFO:%s'
+TOKEN_MAX_TTL = 3600        # never trust a cached token for longer
+TOKEN_INVALID_TTL = 60      # how long a rejected token stays rejected
+_tokenCache = LRUCache(1000)
+
+
+def _fetchTokenUserId(token):
+    """Ask the tokeninfo endpoint who owns token.
+
+    Returns (user_id, ttl); ttl is None when the answer must not be
+    cached (the endpoint kept failing rather than rejecting the token).
+    """
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    url = TOKENINFO_URL % (token_type, token)
+    wait = 1
+    invalid = False
+    for i in range(3):
+        resp = urlfetch.fetch(url)
+        if resp.status_code == 200:
+            user = json.loads(resp.content)
+            ttl = min(int(user.get('expires_in', TOKEN_MAX_TTL)), TOKEN_MAX_TTL)
+            return user.get('user_id', ''), ttl
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            if invalid:
+                return '', TOKEN_INVALID_TTL
+            invalid = True
+            url = TOKENINFO_URL % ('access_token', token)
+        else:
+            time.sleep(wait)
+            wait = wait + i
+    return '', None
+
+
+def _tokenUserId(token):
+    """Return the user id for an OAuth token, checking the in-process
+    and memcache tiers before calling tokeninfo."""
+    tokenHash = hashlib.sha256(token).hexdigest()
+    cached = _tokenCache.get(tokenHash)
+    if cached is not None:
+        return cached
+
+    key = MEMCACHE_TOKENINFO_KEY % tokenHash
+    entry = memcache.get(key)
+    if entry is None:
+        user_id, ttl = _fetchTokenUserId(token)
+        if ttl is None or ttl <= 0:
+            return user_id
+        entry = (user_id, time.time() + ttl)
+        memcache.set(key, entry, time=ttl)
+    _tokenCache.set(tokenHash, entry[0], expires=entry[1])
+    return entry[0]
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
@@ -14,25 +74,7 @@ def getUserId(user, id_type="email"):
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _tokenUserId(token)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm